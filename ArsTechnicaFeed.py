@@ -1,44 +1,17 @@
-import feedparser
-import json
-import time
-import requests
-from bs4 import BeautifulSoup
-from pymongo import MongoClient
-
-def get_mongo_collection(collection_name):
-    client = MongoClient('localhost', 27017) 
-    db = client.NewsFeeds  # your database name
-    return db[collection_name]
-
-def save_last_seen_entry(feed_name, last_seen_entry_id):
-    with open(f"last_seen_{feed_name}.txt", "w") as file:
-        file.write(last_seen_entry_id)
-
-def update_last_seen_in_db(feed_name, last_seen_entry_id):
-    feed_info_collection = get_mongo_collection(collection_name)
-    query = {"name": feed_name}
-    new_values = {"$set": {"last_seen": last_seen_entry_id}}
-    feed_info_collection.update_one(query, new_values)
-
-
-def fetch_new_entries(url, last_seen_entry_id):
-    feed = feedparser.parse(url)
-    new_entries = []
-
-    for entry in feed.entries:
-        entry_id = entry.get("id", entry.link)  # Using link as a fallback identifier
-        if entry_id != last_seen_entry_id:
-            new_entries.append(entry)
-        else:
-            break
-
-    return new_entries
+from MongoDBHandler import DEFAULT_URI, MongoDBHandler
+from FeedCycle import document_seen, document_validators, fetch_new_entries, fetched, read_new_entries, run_script, save_document_state
+from SeenIndex import entry_key
+from Outbox import get_outbox
+from Extraction import fetch_previews
+from PreviewExtractor import RULE_IMG_AFTER_TITLE
+
+def get_mongo_handler():
+    return MongoDBHandler(DEFAULT_URI, "NewsFeeds", collection_name)
 
 def load_feed_info():
-    feed_info_collection = get_mongo_collection("ATech")
-    return list(feed_info_collection.find({}))
+    return get_mongo_handler().get_feed_info()
     
-def send_discord_message(webhook_url, feed_name, feed_icon, color, tags, image, entry):
+def build_message(feed_name, feed_icon, color, tags, image, entry):
     data = {
         "username": feed_name,
         "avatar_url": feed_icon,
@@ -61,60 +34,59 @@ def send_discord_message(webhook_url, feed_name, feed_icon, color, tags, image,
 
         ]
     }
-    headers = {"Content-Type": "application/json"}
-    response = requests.post(webhook_url, data=json.dumps(data), headers=headers)
-    if response.status_code == 204:
-        print("Message sent successfully")
-    else:
-        print(f"Failed to send message: {response.status_code}")
-
-def fetch_preview(url):
-    try:
-        response = requests.get(url)
-        response.raise_for_status() 
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        title_tag = soup.find('title')
-        first_image_url = None
-        if title_tag:
-            first_image_tag = title_tag.find_next('img')
-            if first_image_tag and first_image_tag.get('src'):
-                first_image_url = first_image_tag['src']
+    return data
 
-        if not first_image_url:
-            first_image_url = None
+def send_discord_message(webhook_url, feed_name, feed_icon, color, tags, image, entry):
+    get_outbox().enqueue(webhook_url, build_message(feed_name, feed_icon, color, tags, image, entry), entry_key(entry))
 
-        return first_image_url
-    except Exception as e:
-        return str(e)
+def fetch_preview(url):
+    # Prefers og:image, otherwise the first img after <title>
+    return fetch_previews([url], RULE_IMG_AFTER_TITLE)[0]
 
-collection_name = "ATech"
-get_mongo_collection(collection_name)
 
-feed_info = load_feed_info()
-for feed in feed_info:
+def process_feed(feed, result, uow):
     feed_name = feed['name']
     feed_icon = feed['icon']
-    feed_url = feed['address']
     feed_color = feed['color']
     webhook = feed['webhook']
 
-    last_seen_entry_id = feed['last_seen']
-    new_entries = fetch_new_entries(feed_url, last_seen_entry_id)
+    if not fetched(feed, result):
+        return 0
+
+    seen = load_seen(feed)
+    new_entries = read_new_entries(feed, result, seen)
+
+    # Cache misses are downloaded and parsed together, in the extraction pool for big batches
+    images = fetch_previews([entry.link for entry in new_entries], RULE_IMG_AFTER_TITLE)
+    for entry, image in zip(new_entries, images):
+        tags = ""
+        if entry.tags:
+            for tag in entry.tags:
+                tags += tag.term + ", "
+            tags = tags[:-2]
+        print(f"Sending new entry: {entry.title}")
+        send_discord_message(webhook, feed_name, feed_icon, feed_color, tags, image, entry)
+
+    save_document_state(uow, feed, result, seen, new_entries)
+    return len(new_entries)
+
+
+# The feed's seen state and validators live in its Mongo document
+load_seen = document_seen
+feed_validators = document_validators
+
+
+def unit_of_work():
+    return get_mongo_handler().unit_of_work()
+
+
+collection_name = "ATech"
+NEWEST_FIRST = True  # the feed lists stories newest first, so a poll stops at the ones posted
 
-    if new_entries:
-        last_entry_id = new_entries[0].get("id", new_entries[0].link)
-        update_last_seen_in_db(feed_name, last_entry_id)
 
+def main():
+    run_script(__name__)
 
-        for entry in new_entries:
-            tags = ""
-            image = fetch_preview(entry.link)
-            if entry.tags:
-                for tag in entry.tags:
-                    tags += tag.term + ", "
-                tags = tags[:-2]
-            time.sleep(1)
-            print(f"Sending new entry: {entry.title}")
-            send_discord_message(webhook, feed_name, feed_icon, feed_color, tags, image, entry)
 
+if __name__ == "__main__":
+    main()
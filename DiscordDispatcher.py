@@ -0,0 +1,177 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlsplit, urlunsplit
+
+from HttpClient import get_http_client
+from Metrics import RATE_LIMIT_WAIT, WEBHOOK_RESPONSES, WEBHOOK_SECONDS
+
+MAX_RETRIES = 5
+
+
+def webhook_label(webhook_url):
+    # The webhook id from .../webhooks/<id>/<token>; the token never goes into metrics
+    parts = webhook_url.rstrip("/").split("/")
+    return parts[-2] if len(parts) >= 3 and parts[-3] == "webhooks" else parts[-1]
+
+
+def message_url(webhook_url, message_id=None, wait=False):
+    # The webhook's url for editing message_id, or for posting; wait=true makes Discord answer
+    # a post with the new message (and its id) instead of 204
+    parts = urlsplit(webhook_url)
+    path = f"{parts.path.rstrip('/')}/messages/{message_id}" if message_id else parts.path
+    query = "&".join(filter(None, (parts.query, "wait=true"))) if wait and not message_id else parts.query
+    return urlunsplit(parts._replace(path=path, query=query))
+
+
+class RateLimitBucket:
+    # Tracks one webhook's X-RateLimit-* window so we only wait when Discord says we must
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Returns how long we slept before a token was available
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.reset_at:
+                # The window is over; start from the full limit (or unknown until Discord tells us)
+                self.remaining = self.limit
+            wait = 0.0
+            if self.remaining is not None:
+                if self.remaining <= 0:
+                    wait = self.reset_at - now
+                self.remaining -= 1
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def update(self, headers):
+        with self.lock:
+            if "X-RateLimit-Limit" in headers:
+                self.limit = int(headers["X-RateLimit-Limit"])
+            if "X-RateLimit-Remaining" in headers:
+                self.remaining = int(headers["X-RateLimit-Remaining"])
+            if "X-RateLimit-Reset-After" in headers:
+                self.reset_at = time.monotonic() + float(headers["X-RateLimit-Reset-After"])
+
+    def block_for(self, seconds):
+        with self.lock:
+            self.remaining = 0
+            self.reset_at = time.monotonic() + seconds
+
+
+class DiscordDispatcher:
+    # One worker thread per webhook keeps each channel's messages in order while
+    # different webhooks are posted to in parallel
+    _STOP = object()
+
+    def __init__(self, max_retries=MAX_RETRIES, timeout=None, client=None):
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.client = client or get_http_client()
+        self.global_bucket = RateLimitBucket()
+        self._buckets = {}
+        self._queues = {}
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def submit(self, webhook_url, data, message_id=None, wait=False):
+        # With message_id the webhook's earlier message is edited (PATCH) instead of a new one posted.
+        # Edits go through the same per-webhook queue, so they never overtake the post they edit.
+        future = Future()
+        with self._lock:
+            if webhook_url not in self._queues:
+                self._buckets[webhook_url] = RateLimitBucket()
+                self._queues[webhook_url] = queue.Queue()
+                worker = threading.Thread(target=self._run, args=(webhook_url,), daemon=True)
+                self._workers[webhook_url] = worker
+                worker.start()
+            self._queues[webhook_url].put((data, future, message_id, wait))
+        return future
+
+    def send(self, webhook_url, data):
+        return self.submit(webhook_url, data).result()
+
+    def close(self):
+        # Waits for every queued message to be posted
+        with self._lock:
+            workers = list(self._workers.values())
+            for message_queue in self._queues.values():
+                message_queue.put(self._STOP)
+            self._queues = {}
+            self._workers = {}
+            self._buckets = {}
+        for worker in workers:
+            worker.join()
+
+    def _run(self, webhook_url):
+        message_queue = self._queues[webhook_url]
+        bucket = self._buckets[webhook_url]
+        while True:
+            item = message_queue.get()
+            if item is self._STOP:
+                return
+            data, future, message_id, wait = item
+            try:
+                response = self._post(webhook_url, bucket, data, message_id, wait)
+                if response.status_code in (200, 204):
+                    print("Message sent successfully")
+                else:
+                    print(f"Failed to send message: {response.status_code}")
+                future.set_result(response)
+            except Exception as e:
+                print(f"Failed to send message: {e}")
+                future.set_exception(e)
+
+    def _post(self, webhook_url, bucket, data, message_id=None, wait=False):
+        headers = {"Content-Type": "application/json"}
+        body = json.dumps(data)
+        label = webhook_label(webhook_url)
+        method = "PATCH" if message_id else "POST"
+        url = message_url(webhook_url, message_id, wait)
+        for attempt in range(self.max_retries + 1):
+            RATE_LIMIT_WAIT.inc(self.global_bucket.acquire(), webhook=label, scope="global")
+            RATE_LIMIT_WAIT.inc(bucket.acquire(), webhook=label, scope="webhook")
+            try:
+                with WEBHOOK_SECONDS.time(webhook=label):
+                    response = self.client.request(method, url, data=body, headers=headers, timeout=self.timeout)
+            except Exception:
+                WEBHOOK_RESPONSES.inc(webhook=label, status="error")
+                raise
+            WEBHOOK_RESPONSES.inc(webhook=label, status=response.status_code)
+            bucket.update(response.headers)
+            if response.status_code != 429 or attempt == self.max_retries:
+                return response
+
+            retry_after = self._retry_after(response)
+            if response.headers.get("X-RateLimit-Global") or response.headers.get("X-RateLimit-Scope") == "global":
+                self.global_bucket.block_for(retry_after)
+            else:
+                bucket.block_for(retry_after)
+            print(f"Rate limited by Discord, retrying in {retry_after:.2f}s")
+        return response
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.json()["retry_after"])
+        except (ValueError, KeyError, TypeError):
+            return float(response.headers.get("Retry-After", 1))
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    # Shared by every source in a process, so the global rate limit is tracked in one place
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = DiscordDispatcher()
+        return _dispatcher
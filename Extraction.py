@@ -0,0 +1,121 @@
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit
+
+from HtmlBackend import parse
+from Metrics import PREVIEW_SECONDS
+from PreviewCache import get_preview_cache
+from PreviewExtractor import fetch_preview_image
+
+# HTML parsing is CPU bound and holds the GIL, so a cycle with hundreds of new entries parses them
+# in worker processes. Jobs take and return plain strings and tuples, never parse trees.
+_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+# One core is left to the main process; EXTRACTION_WORKERS=1 keeps all parsing in-process
+WORKERS = int(os.environ.get("EXTRACTION_WORKERS", min(8, max(1, _CPUS - 1))))
+INLINE_BELOW = 8   # batches smaller than this are parsed in-process; starting a job costs more than it saves
+
+
+def verge_content(html):
+    # (image_url, summary): the first img in the entry content and the text of the paragraph after it
+    document = parse(html)
+    return document.first_img_src(), document.first_p_text_after_img() or ''
+
+
+def alert_fields(html):
+    # (impact, desc, date): the text of the first three divs of a WSDoT alert summary
+    texts = parse(html).div_texts(3)
+    return tuple(texts + [""] * (3 - len(texts)))
+
+
+def preview_image(url, rule, prefer_meta=True):
+    # (image_url, error, seconds); the worker's own timing, since its metrics don't reach the parent
+    start = time.perf_counter()
+    try:
+        return fetch_preview_image(url, rule, prefer_meta), None, time.perf_counter() - start
+    except Exception as e:
+        return None, str(e), time.perf_counter() - start
+
+
+def _call(job):
+    function, args = job
+    return function(*args)
+
+
+class ExtractionPool:
+    def __init__(self, workers=WORKERS, inline_below=INLINE_BELOW):
+        self.workers = workers
+        self.inline_below = inline_below
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def map(self, function, args_list):
+        # function(*args) for each args tuple, in order. function must be importable (module level).
+        args_list = list(args_list)
+        if self.workers <= 1 or len(args_list) < self.inline_below:
+            return [function(*args) for args in args_list]
+        try:
+            executor = self._get_executor()
+            chunksize = max(1, math.ceil(len(args_list) / (self.workers * 4)))
+            return list(executor.map(_call, [(function, args) for args in args_list], chunksize=chunksize))
+        except (BrokenProcessPool, OSError) as e:
+            print(f"Extraction pool failed, parsing in-process: {e}")
+            self.close()
+            return [function(*args) for args in args_list]
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, since forking a process that has dispatcher and outbox threads can copy held locks
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def close(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def fetch_previews(urls, rule, prefer_meta=True, pool=None):
+    # The preview image for each url, from the cache or else downloaded and parsed in the pool.
+    # A failed fetch is remembered in the cache and comes back as None, like a cached failure, since
+    # Discord rejects a post whose image url is an error message.
+    preview_cache = get_preview_cache()
+    images = {}
+    missing = []
+    for url in dict.fromkeys(urls):
+        found, cached_image_url = preview_cache.get(url)
+        if found:
+            images[url] = cached_image_url
+        else:
+            missing.append(url)
+
+    results = (pool or get_extraction_pool()).map(preview_image, [(url, rule, prefer_meta) for url in missing])
+    for url, (image_url, error, seconds) in zip(missing, results):
+        PREVIEW_SECONDS.observe(seconds, site=urlsplit(url).netloc.lower())
+        if error is None:
+            preview_cache.set(url, image_url)
+            images[url] = image_url
+        else:
+            print(f"Failed to fetch preview for {url}: {error}")
+            preview_cache.set_failure(url)
+            images[url] = None
+    return [images[url] for url in urls]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_extraction_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExtractionPool()
+        return _pool
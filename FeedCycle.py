@@ -0,0 +1,159 @@
+import contextlib
+import json
+import sys
+
+from FeedFetcher import FeedFetcher
+from FeedStream import feed_readers, reader_for, url_validators
+from Metrics import NEW_ENTRIES, PARSE_SECONDS
+from Outbox import get_outbox
+from SeenIndex import SeenIndex, entry_key
+
+# The poll cycle every source script runs, from its own main, from discordfeeds and from FeedDaemon:
+# fetch the feeds concurrently, then hand each result to the script's process_feed. A script module
+# provides
+#   load_feed_info()                  its feed configs
+#   load_seen(feed)                   the feed's SeenIndex
+#   feed_validators(feed)             (etag, last_modified) saved from the last fetch
+#   process_feed(feed, result, ...)   posts the new entries and saves the feed's state; returns how many
+# and, when it needs them,
+#   NEWEST_FIRST = True               its feeds list entries newest first (see feed_reader)
+#   unit_of_work()                    for state kept in Mongo; process_feed gets the cycle's unit of work
+#   cycle_context([uow])              keyword arguments for every process_feed of a cycle (a pass index)
+
+
+def parse_entries(url, content=None, entries=None):
+    # entries come from FeedFetcher's streaming reader; otherwise feedparser parses content (the raw
+    # body) or, without it, downloads the url itself
+    if entries is None:
+        import feedparser  # loaded on first parse, so 304-only cycles never pay for it
+        entries = feedparser.parse(content if content is not None else url).entries
+    return entries
+
+
+def fetch_new_entries(url, seen, content=None, entries=None):
+    return seen.new_entries(parse_entries(url, content, entries))
+
+
+def fetched(feed, result):
+    # Whether result has a body to process; a 304 is skipped quietly, a failure is reported
+    if result.not_modified:
+        return False
+    if not result.ok:
+        print(f"Failed to fetch {feed['name']}: {result.error}")
+        return False
+    return True
+
+
+def read_new_entries(feed, result, seen, fetch=fetch_new_entries):
+    with PARSE_SECONDS.time(feed=feed['name']):
+        entries = fetch(feed['address'], seen, result.content, result.entries)
+    NEW_ENTRIES.inc(len(entries), feed=feed['name'])
+    return entries
+
+
+# State kept in the feed's Mongo document
+
+def document_seen(feed, key=entry_key):
+    return SeenIndex.from_document(feed.get('seen'), feed.get('seen_bloom', False), feed.get('last_seen'), key=key)
+
+
+def document_validators(feed):
+    return feed.get('etag'), feed.get('last_modified')
+
+
+def save_document_state(uow, feed, result, seen, entries):
+    # Seen state and validators are saved together, and only once the posts are safely in the
+    # outbox: saved any earlier, a failure would leave the entries behind a 304
+    values = {}
+    if entries:
+        seen.mark_seen(entries)
+        values["last_seen"] = entries[0].get("id", entries[0].link)
+    if seen.changed:
+        values["seen"] = seen.to_document()
+    if (result.etag, result.last_modified) != document_validators(feed):
+        values.update(etag=result.etag, last_modified=result.last_modified)
+    if values:
+        uow.update_feed(feed['name'], values, feed)
+
+
+# State kept in files next to the script
+
+def save_last_seen_entry(feed_name, last_seen_entry_id):
+    with open(f"last_seen_{feed_name}.txt", "w") as file:
+        file.write(last_seen_entry_id)
+
+
+def load_last_seen_entry(feed_name):
+    try:
+        with open(f"last_seen_{feed_name}.txt", "r") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def save_file_validators(feed_name, etag, last_modified):
+    with open(f"validators_{feed_name}.json", "w") as file:
+        json.dump({"etag": etag, "last_modified": last_modified}, file)
+
+
+def file_validators(feed):
+    try:
+        with open(f"validators_{feed['name']}.json", "r") as file:
+            validators = json.load(file)
+            return validators.get("etag"), validators.get("last_modified")
+    except FileNotFoundError:
+        return None, None
+
+
+def file_seen(feed, key=entry_key):
+    return SeenIndex.load_from_file(feed['name'], feed.get('seen_bloom', False), load_last_seen_entry(feed['name']), key=key)
+
+
+def save_file_state(feed, result, seen, entries):
+    # As save_document_state, for the files
+    if entries:
+        seen.mark_seen(entries)
+        save_last_seen_entry(feed['name'], entries[0].get("id", entries[0].link))
+    if seen.changed:
+        seen.save_to_file(feed['name'])
+    save_file_validators(feed['name'], result.etag, result.last_modified)
+
+
+# The cycle
+
+def feed_reader(script, feed):
+    # Parses the feed as it downloads. A feed listed newest first is read only until it is back among
+    # entries already posted; any other is read to the end, since an entry revised since the last
+    # poll can be anywhere in it (the pass reports come in pass order). A feed's 'newest_first'
+    # overrides the script's NEWEST_FIRST.
+    if feed.get('newest_first', getattr(script, "NEWEST_FIRST", False)):
+        return reader_for(script.load_seen(feed))
+    return reader_for(None)
+
+
+def process_results(script, feed_info, results):
+    # Returns how many new entries each feed had, for the daemon's poll scheduling. With a unit of
+    # work, a feed that raises discards the whole cycle's writes (see UnitOfWork.__exit__).
+    unit_of_work = getattr(script, "unit_of_work", None)
+    counts = {}
+    with unit_of_work() if unit_of_work is not None else contextlib.nullcontext() as uow:
+        args = (uow,) if unit_of_work is not None else ()
+        context = script.cycle_context(*args) if hasattr(script, "cycle_context") else {}
+        for feed in feed_info:
+            counts[feed['name']] = script.process_feed(feed, results[feed['address']], *args, **context)
+    return counts
+
+
+def run_cycle(script, feed_info, fetcher=None):
+    validators = url_validators(feed_info, script.feed_validators)
+    readers = feed_readers(feed_info, lambda feed: feed_reader(script, feed))
+    results = (fetcher or FeedFetcher()).fetch_all((feed['address'] for feed in feed_info), validators, readers)
+    process_results(script, feed_info, results)
+    return results
+
+
+def run_script(module_name):
+    # One cycle for a script run on its own (python NPRFeed.py), then whatever the outbox still holds
+    script = sys.modules[module_name]
+    run_cycle(script, script.load_feed_info())
+    get_outbox().close()
@@ -0,0 +1,182 @@
+import heapq
+import importlib
+import itertools
+import signal
+import threading
+import time
+
+import FeedCycle
+from FeedFetcher import FeedFetcher, normalize_url
+from FeedStream import shared_readers, shared_validators
+from Metrics import DEFAULT_HOST, REGISTRY
+from Outbox import get_outbox
+from PollSchedule import MAX_INTERVAL, MIN_INTERVAL, AdaptiveInterval
+from discordfeeds import SOURCES
+
+DEFAULT_INTERVAL = 300   # starting poll interval unless a feed's config sets 'interval'
+CONFIG_REFRESH = 600     # seconds between reloads of the feed configs
+
+
+class FeedDaemon:
+    # Keeps every source's modules, HTTP pools, caches and Mongo clients loaded and polls each
+    # feed when it falls due, using a min-heap of next-due times. Each feed's interval adapts
+    # to how often it actually publishes (see PollSchedule). Feeds subscribed to the same url, in
+    # any source, are polled together so the url is fetched and parsed once for all of them.
+    def __init__(self, sources=None, interval=DEFAULT_INTERVAL, config_refresh=CONFIG_REFRESH, fetcher=None,
+                 min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, metrics_port=None, metrics_host=DEFAULT_HOST):
+        self.interval = interval
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.config_refresh = config_refresh
+        self.fetcher = fetcher or FeedFetcher()
+        self.modules = {name: importlib.import_module(SOURCES[name]) for name in (sources or SOURCES)}
+        self.feeds = {}
+        self.intervals = {}
+        self.heap = []
+        self.due_at = {}
+        self.subscribers = {}   # normalized url -> keys of the feeds polling it
+        self.stopping = threading.Event()
+        self._counter = itertools.count()
+        self._configs_loaded_at = None
+        self._metrics_server = None
+
+    def stop(self, *args):
+        if not self.stopping.is_set():
+            print("Stopping after the current cycle...")
+        self.stopping.set()
+
+    def feed_bounds(self, feed):
+        # Per-feed 'min_interval'/'max_interval' override the daemon's; set them equal for a fixed schedule
+        return feed.get('min_interval', self.min_interval), feed.get('max_interval', self.max_interval)
+
+    def load_configs(self):
+        now = time.monotonic()
+        current = set()
+        for source, module in self.modules.items():
+            try:
+                feed_info = module.load_feed_info()
+            except Exception as e:
+                print(f"Failed to load feeds for {source}: {e}")
+                current.update(key for key in self.feeds if key[0] == source)
+                continue
+            for feed in feed_info:
+                key = (source, feed['name'])
+                current.add(key)
+                if key not in self.feeds:
+                    self.intervals[key] = AdaptiveInterval(feed.get('interval', self.interval), *self.feed_bounds(feed))
+                    self.schedule(key, now)
+                else:
+                    self.intervals[key].set_bounds(*self.feed_bounds(feed))
+                self.feeds[key] = feed
+        # Feeds removed from the config drop out here; their heap entries are skipped when popped
+        for key in set(self.feeds) - current:
+            del self.feeds[key]
+            del self.intervals[key]
+            del self.due_at[key]
+        self.subscribers = {}
+        for key, feed in self.feeds.items():
+            self.subscribers.setdefault(normalize_url(feed['address']), []).append(key)
+        self._configs_loaded_at = now
+
+    def schedule(self, key, due_at):
+        self.due_at[key] = due_at
+        heapq.heappush(self.heap, (due_at, next(self._counter), key))
+
+    def pop_due(self, now):
+        due = {}
+        while self.heap and self.heap[0][0] <= now:
+            due_at, _, key = heapq.heappop(self.heap)
+            # Entries of removed feeds, and ones replaced by a later schedule(), are skipped
+            if key in self.feeds and self.due_at[key] == due_at:
+                due[key] = None
+        # A due feed brings along the other subscriptions to its url, whenever they were due
+        for key in list(due):
+            for other in self.subscribers.get(normalize_url(self.feeds[key]['address']), ()):
+                due.setdefault(other)
+        return list(due)
+
+    def run_once(self, keys):
+        # Fetch every due feed across all sources in one concurrent batch, then process per source
+        by_source = {}
+        for key in keys:
+            by_source.setdefault(key[0], []).append(self.feeds[key])
+
+        validators = []
+        readers = []
+        for source, feeds in by_source.items():
+            module = self.modules[source]
+            for feed in feeds:
+                validators.append((feed['address'], module.feed_validators(feed)))
+                readers.append((feed['address'], FeedCycle.feed_reader(module, feed)))
+        validators = shared_validators(validators)
+        results = self.fetcher.fetch_all(list(validators), validators, shared_readers(readers))
+
+        counts = {}
+        for source, feeds in by_source.items():
+            try:
+                source_counts = FeedCycle.process_results(self.modules[source], feeds, results)
+            except Exception as e:
+                print(f"Failed to process {source}: {e}")
+                continue
+            for feed in feeds:
+                counts[(source, feed['name'])] = source_counts.get(feed['name'], 0)
+        return results, counts
+
+    def reschedule(self, keys, results, counts):
+        now = time.monotonic()
+        for key in keys:
+            if key not in self.feeds:
+                continue
+            result = results.get(self.feeds[key]['address'])
+            # A failed fetch or a source that raised while processing both count as errors
+            error = key not in counts or result is None or not (result.ok or result.not_modified)
+            interval = self.intervals[key].observe(now, counts.get(key, 0), error)
+            self.schedule(key, now + interval)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.load_configs()
+        # Messages left in the outbox by an earlier run go out alongside new ones
+        get_outbox().start()
+        if self.metrics_port is not None:
+            self._metrics_server = REGISTRY.serve(self.metrics_port, self.metrics_host)
+            print(f"Serving metrics on {self.metrics_host}:{self.metrics_port}")
+        try:
+            while not self.stopping.is_set():
+                now = time.monotonic()
+                if now - self._configs_loaded_at >= self.config_refresh:
+                    self.load_configs()
+
+                due = self.pop_due(now)
+                if not due:
+                    next_due = self.heap[0][0] if self.heap else now + self.config_refresh
+                    self.stopping.wait(max(0.0, min(next_due, self._configs_loaded_at + self.config_refresh) - now))
+                    continue
+
+                try:
+                    results, counts = self.run_once(due)
+                except Exception as e:
+                    print(f"Poll cycle failed: {e}")
+                    results, counts = {}, {}
+                self.reschedule(due, results, counts)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        # Messages due now are posted before we exit; any still backing off stay in the outbox
+        get_outbox().close()
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+            self._metrics_server = None
+        print("Feed daemon stopped")
+
+
+def main(sources=None, interval=DEFAULT_INTERVAL, metrics_port=None, metrics_host=DEFAULT_HOST):
+    FeedDaemon(sources, interval, metrics_port=metrics_port, metrics_host=metrics_host).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+from HttpClient import get_http_client
+from Metrics import FETCH_BYTES, FETCH_RESPONSES, FETCH_SECONDS
+
+MAX_CONCURRENCY = 32
+PER_HOST_CONCURRENCY = 4
+CHUNK_SIZE = 16 * 1024  # body chunk handed to a streaming reader
+MAX_SECONDS = 60        # longest one download may take in all; the read timeout alone doesn't stop a trickle
+MAX_BYTES = 16 * 1024 * 1024  # largest body accepted, after decompression
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url):
+    # Feeds configured with different spellings of one address (case of scheme and host, a
+    # default port, a fragment) share a single fetch
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    userinfo, _, host = parts.netloc.rpartition("@")
+    host = host.lower()
+    if parts.port is not None and _DEFAULT_PORTS.get(scheme) == parts.port:
+        host = host.rpartition(":")[0]
+    netloc = f"{userinfo}@{host}" if userinfo else host
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+class FetchLimitError(Exception):
+    pass
+
+
+class FetchResult:
+    def __init__(self, url, status=None, content=None, error=None, etag=None, last_modified=None, entries=None):
+        self.url = url
+        self.status = status
+        self.content = content
+        self.error = error
+        self.etag = etag
+        self.last_modified = last_modified
+        self.entries = entries  # already parsed by a streaming reader, or None
+
+    @property
+    def ok(self):
+        return self.error is None and self.content is not None
+
+    @property
+    def not_modified(self):
+        return self.status == 304
+
+
+class FeedFetcher:
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, per_host_concurrency=PER_HOST_CONCURRENCY, timeout=None, client=None,
+                 max_seconds=MAX_SECONDS, max_bytes=MAX_BYTES):
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.timeout = timeout
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.client = client or get_http_client()
+
+    def fetch_all(self, urls, validators=None, readers=None):
+        # Returns {url: FetchResult}; urls that normalize the same are downloaded once and share
+        # the result, fetched with the validators and reader of the first of them.
+        # validators maps url -> (etag, last_modified) from the previous fetch.
+        # readers maps url -> a callable that parses the body as it streams in (see FeedStream)
+        return asyncio.run(self.fetch_all_async(urls, validators, readers))
+
+    async def fetch_all_async(self, urls, validators=None, readers=None):
+        validators = validators or {}
+        readers = readers or {}
+        spellings = {}
+        for url in urls:
+            spellings.setdefault(normalize_url(url), {})[url] = None
+        unique_urls = [next(iter(same)) for same in spellings.values()]
+        if not unique_urls:
+            return {}
+        loop = asyncio.get_running_loop()
+        global_limit = asyncio.Semaphore(self.max_concurrency)
+        host_limits = {}
+        for url in unique_urls:
+            host = urlsplit(url).netloc.lower()
+            if host not in host_limits:
+                host_limits[host] = asyncio.Semaphore(self.per_host_concurrency)
+
+        async def fetch_limited(url):
+            host_limit = host_limits[urlsplit(url).netloc.lower()]
+            async with host_limit:
+                async with global_limit:
+                    return await loop.run_in_executor(executor, self._fetch, url, validators.get(url), readers.get(url))
+
+        # requests is blocking, so each download runs on a worker thread sized to the global limit
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(unique_urls))) as executor:
+            results = await asyncio.gather(*(fetch_limited(url) for url in unique_urls))
+        return {url: result for same, result in zip(spellings.values(), results) for url in same}
+
+    def _fetch(self, url, validator=None, reader=None):
+        with FETCH_SECONDS.time(url=url):
+            result = self._download(url, validator, reader)
+        FETCH_RESPONSES.inc(url=url, status=result.status or "error")
+        if result.content is not None:
+            FETCH_BYTES.inc(len(result.content), url=url)
+        return result
+
+    def _download(self, url, validator=None, reader=None):
+        deadline = time.monotonic() + self.max_seconds
+        headers = {}
+        etag, last_modified = validator or (None, None)
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        try:
+            with self.client.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304:
+                    return FetchResult(url, 304, etag=etag, last_modified=last_modified)
+                response.raise_for_status()
+                if int(response.headers.get("Content-Length") or 0) > self.max_bytes:
+                    raise FetchLimitError(f"body of {response.headers['Content-Length']} bytes is over {self.max_bytes}")
+                chunks = self._chunks(response, deadline)
+                if reader is None:
+                    content, entries = b"".join(chunks), None
+                else:
+                    # The reader may stop early; leaving the block closes the rest of the download
+                    feed = reader(chunks)
+                    content, entries = feed.content, feed.entries
+                return FetchResult(url, response.status_code, content,
+                                   etag=response.headers.get("ETag"),
+                                   last_modified=response.headers.get("Last-Modified"),
+                                   entries=entries)
+        except Exception as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            return FetchResult(url, status, error=str(e))
+
+    def _chunks(self, response, deadline):
+        # The body as it arrives, raising FetchLimitError past the deadline or max_bytes. read1
+        # returns whatever one socket read brings, so a server dribbling bytes can't keep a single
+        # read going past the deadline the way iter_content's fill-the-chunk reads would.
+        received = 0
+        while True:
+            chunk = response.raw.read1(CHUNK_SIZE, decode_content=True)
+            if not chunk:
+                return
+            received += len(chunk)
+            if received > self.max_bytes:
+                raise FetchLimitError(f"body is over {self.max_bytes} bytes")
+            if time.monotonic() > deadline:
+                raise FetchLimitError(f"download took over {self.max_seconds}s")
+            yield chunk
@@ -0,0 +1,212 @@
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+from FeedFetcher import normalize_url
+
+STOP_AFTER = 3   # already-seen entries in a row that end the read; one pinned old post at the top won't
+
+_ATOM = "{http://www.w3.org/2005/Atom}"
+_RSS1 = "{http://purl.org/rss/1.0/}"
+_RDF = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}RDF"
+_CONTENT_ENCODED = "{http://purl.org/rss/1.0/modules/content/}encoded"
+_DC = "{http://purl.org/dc/elements/1.1/}"
+_ROOTS = frozenset(("rss", _ATOM + "feed", _RDF))
+_ENTRIES = frozenset(("item", _ATOM + "entry", _RSS1 + "item"))
+
+
+class FeedFormatError(Exception):
+    pass
+
+
+class FeedEntry(dict):
+    # Reads like feedparser's FeedParserDict (entry.title, entry.get("id", entry.link)), so the
+    # scripts and SeenIndex keys work the same on streamed and feedparser entries
+    def __missing__(self, key):
+        # feedparser falls back to the published date when an entry has no updated date
+        if key == "updated" and "published" in self:
+            return self["published"]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class StreamedFeed:
+    __slots__ = ("entries", "content", "complete")
+
+    def __init__(self, entries, content, complete):
+        self.entries = entries      # None when the feed has to go through feedparser instead
+        self.content = content      # the bytes read, all of them unless the read stopped early
+        self.complete = complete
+
+
+def _text(element):
+    if element.get("type") == "xhtml":
+        return "".join(element.itertext()).strip()
+    return (element.text or "").strip()
+
+
+def _rss_entry(item):
+    entry = FeedEntry()
+    guid_is_link = False
+    for child in item:
+        tag = child.tag.removeprefix(_RSS1)
+        if tag == "title":
+            entry["title"] = _text(child)
+        elif tag == "link":
+            entry["link"] = _text(child)
+        elif tag == "guid":
+            entry["id"] = _text(child)
+            guid_is_link = child.get("isPermaLink", "true").lower() != "false"
+        elif tag == "description":
+            entry["summary"] = _text(child)
+        elif tag == _CONTENT_ENCODED:
+            entry.setdefault("content", []).append(FeedEntry(type="text/html", value=_text(child)))
+        elif tag == "category":
+            entry.setdefault("tags", []).append(FeedEntry(term=_text(child), scheme=child.get("domain"), label=None))
+        elif tag == "pubDate":
+            entry["published"] = _text(child)
+        elif tag == _DC + "date":
+            entry["updated"] = _text(child)
+        elif tag in ("author", _DC + "creator"):
+            entry["author"] = _text(child)
+    if guid_is_link and "link" not in entry:
+        entry["link"] = entry["id"]
+    return entry
+
+
+def _atom_entry(element):
+    entry = FeedEntry()
+    for child in element:
+        tag = child.tag.removeprefix(_ATOM)
+        if tag == "title":
+            entry["title"] = _text(child)
+        elif tag == "id":
+            entry["id"] = _text(child)
+        elif tag == "link":
+            if child.get("rel", "alternate") == "alternate" and "link" not in entry:
+                entry["link"] = child.get("href", "").strip()
+        elif tag == "summary":
+            entry["summary"] = _text(child)
+        elif tag == "content":
+            entry.setdefault("content", []).append(FeedEntry(type="text/html", value=_text(child)))
+        elif tag == "category":
+            entry.setdefault("tags", []).append(FeedEntry(term=child.get("term"), scheme=child.get("scheme"), label=child.get("label")))
+        elif tag in ("updated", "published"):
+            entry[tag] = _text(child)
+        elif tag == "author":
+            entry["author"] = (child.findtext(_ATOM + "name") or "").strip()
+    return entry
+
+
+def iter_entries(chunks):
+    # Yields entries as soon as each one closes; elements already handed out are dropped, so
+    # memory stays at one entry however long the feed is
+    parser = ET.XMLPullParser(events=("start", "end"))
+    stack = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == "start":
+                if not stack and element.tag not in _ROOTS:
+                    raise FeedFormatError(f"not a feed: <{element.tag}>")
+                stack.append(element)
+                continue
+            stack.pop()
+            if element.tag in _ENTRIES:
+                entry = _atom_entry(element) if element.tag.startswith(_ATOM) else _rss_entry(element)
+                if "summary" not in entry and "content" in entry:
+                    entry["summary"] = entry["content"][0]["value"]
+                yield entry
+                if stack:
+                    stack[-1].remove(element)
+    parser.close()
+
+
+def read_feed(chunks, seen=None, stop_after=STOP_AFTER):
+    # Reads entries until stop_after in a row are already in seen (a SeenIndex). With nothing
+    # seen yet, or a legacy last_seen id still to migrate, the whole feed is read.
+    buffer = []
+
+    def recorded():
+        for chunk in chunks:
+            buffer.append(chunk)
+            yield chunk
+
+    body = recorded()
+    stop = seen is not None and len(seen) > 0
+    entries = []
+    seen_in_a_row = 0
+    try:
+        for entry in iter_entries(body):
+            entries.append(entry)
+            if stop:
+                seen_in_a_row = seen_in_a_row + 1 if seen.key(entry) in seen else 0
+                if seen_in_a_row >= stop_after:
+                    return StreamedFeed(entries, b"".join(buffer), False)
+    except (ET.ParseError, FeedFormatError):
+        # Malformed XML, undefined HTML entities, an HTML error page: leave it to feedparser
+        for _ in body:
+            pass
+        return StreamedFeed(None, b"".join(buffer), True)
+    return StreamedFeed(entries, b"".join(buffer), True)
+
+
+def reader_for(seen, stop_after=STOP_AFTER):
+    # The callable FeedFetcher runs over the response body on its worker thread
+    return lambda chunks: read_feed(chunks, seen, stop_after)
+
+
+def read_shared_feed(chunks):
+    # For a feed several subscriptions share: read in full, since each has its own seen state, and
+    # parsed here even when feedparser has to do it, so the subscriptions don't each parse it again
+    feed = read_feed(chunks)
+    if feed.entries is None:
+        import feedparser
+        feed.entries = feedparser.parse(feed.content).entries
+    return feed
+
+
+def shared_readers(readers):
+    # readers is (url, reader) for each subscription; returns {url: reader}. Subscriptions whose
+    # urls normalize the same (see FeedFetcher.normalize_url) share read_shared_feed instead.
+    readers = list(readers)
+    subscriptions = Counter(normalize_url(url) for url, _ in readers)
+    return {url: read_shared_feed if subscriptions[normalize_url(url)] > 1 else reader for url, reader in readers}
+
+
+def shared_validators(validators):
+    # validators is (url, (etag, last_modified)) for each subscription; returns {url: validators}.
+    # A shared feed is only fetched conditionally when all its subscriptions hold the same
+    # validators, so one that is behind the others still gets the entries it hasn't seen.
+    by_feed = {}
+    for url, validator in validators:
+        by_feed.setdefault(normalize_url(url), []).append((url, validator))
+    shared = {}
+    for subscriptions in by_feed.values():
+        agreed = {validator for _, validator in subscriptions}
+        validator = agreed.pop() if len(agreed) == 1 else (None, None)
+        shared.update((url, validator) for url, _ in subscriptions)
+    return shared
+
+
+def feed_readers(feeds, feed_reader):
+    # One reader per url, from feed_reader(feed) unless the url is shared by several feeds
+    return shared_readers((feed['address'], feed_reader(feed)) for feed in feeds)
+
+
+def url_validators(feeds, feed_validators):
+    # One (etag, last_modified) per url, from feed_validators(feed) as shared_validators allows
+    return shared_validators((feed['address'], feed_validators(feed)) for feed in feeds)
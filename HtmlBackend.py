@@ -0,0 +1,158 @@
+import os
+
+# The few HTML lookups the feeds need, over whichever parser is installed: selectolax (lexbor) or
+# lxml when available, else BeautifulSoup's pure-Python html.parser. benchmarks/bench_html_backend.py
+# checks that every backend gives the same answers on the synthetic feed fixtures and pages.
+# HTML_BACKEND=selectolax|lxml|bs4 forces one; the default picks the first that imports.
+BACKENDS = ("selectolax", "lxml", "bs4")
+HTML_BACKEND = os.environ.get("HTML_BACKEND", "auto")
+# Like BeautifulSoup's get_text, element text leaves out what's inside these
+NO_TEXT = frozenset(("script", "style", "template"))
+
+
+class Document:
+    # Subclasses list the document's elements in document order and read tags, attributes and text
+    def __init__(self, elements):
+        self.elements = elements
+
+    def _find(self, tag, start=0):
+        for position in range(start, len(self.elements)):
+            if self._tag(self.elements[position]) == tag:
+                return position
+        return None
+
+    def first_img_src(self, after=None):
+        # src of the first img, or of the first img after the first `after` tag
+        start = 0
+        if after is not None:
+            start = self._find(after)
+            if start is None:
+                return None
+            start += 1
+        position = self._find("img", start)
+        return self._attr(self.elements[position], "src") if position is not None else None
+
+    def first_p_text_after_img(self):
+        # Text of the first p following the first img, or None
+        position = self._find("img")
+        if position is None:
+            return None
+        position = self._find("p", position + 1)
+        return self._text(self.elements[position]) if position is not None else None
+
+    def div_texts(self, limit=None):
+        # Text of each div in document order (nested ones included), up to limit
+        texts = []
+        for element in self.elements:
+            if self._tag(element) == "div":
+                texts.append(self._text(element))
+                if limit is not None and len(texts) >= limit:
+                    break
+        return texts
+
+
+class SoupDocument(Document):
+    def __init__(self, html):
+        from bs4 import BeautifulSoup
+        super().__init__(BeautifulSoup(html, 'html.parser').find_all(True))
+
+    def _tag(self, element):
+        return element.name
+
+    def _attr(self, element, name):
+        return element.get(name)
+
+    def _text(self, element):
+        return element.get_text()
+
+
+class LxmlDocument(Document):
+    def __init__(self, html):
+        import lxml.etree
+        import lxml.html
+        elements = []
+        parser = None
+        if isinstance(html, str):
+            # lxml refuses a str that carries an <?xml ... encoding=...?> declaration; as UTF-8 bytes
+            # with the encoding given, the declaration is ignored like the other backends ignore it
+            html = html.encode("utf-8")
+            parser = lxml.html.HTMLParser(encoding="utf-8")
+        try:
+            document = lxml.html.document_fromstring(html, parser=parser)
+        except lxml.etree.ParserError:
+            # Blank or comment-only input: "Document is empty"
+            document = None
+        if document is not None:
+            # Comments and processing instructions have non-string tags
+            elements = [element for element in document.iter() if isinstance(element.tag, str)]
+        super().__init__(elements)
+
+    def _tag(self, element):
+        return element.tag
+
+    def _attr(self, element, name):
+        return element.get(name)
+
+    def _text(self, element):
+        return "".join(self._strings(element))
+
+    def _strings(self, element):
+        if element.tag in NO_TEXT:
+            return
+        if element.text:
+            yield element.text
+        for child in element:
+            if isinstance(child.tag, str):
+                yield from self._strings(child)
+            if child.tail:
+                yield child.tail
+
+
+class LexborDocument(Document):
+    def __init__(self, html):
+        from selectolax.lexbor import LexborHTMLParser
+        root = LexborHTMLParser(html).root
+        super().__init__(list(root.traverse()) if root is not None else [])
+
+    def _tag(self, element):
+        return element.tag
+
+    def _attr(self, element, name):
+        return element.attributes.get(name)
+
+    def _text(self, element):
+        return "".join(node.text_content for node in element.traverse(include_text=True)
+                       if node.tag == "-text" and node.parent.tag not in NO_TEXT)
+
+
+_DOCUMENTS = {"selectolax": LexborDocument, "lxml": LxmlDocument, "bs4": SoupDocument}
+_MODULES = {"selectolax": "selectolax.lexbor", "lxml": "lxml.html", "bs4": "bs4"}
+
+
+def available_backends():
+    available = []
+    for name in BACKENDS:
+        try:
+            __import__(_MODULES[name])
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+_backend = None
+
+
+def backend_name():
+    global _backend
+    if _backend is None:
+        if HTML_BACKEND != "auto":
+            _backend = HTML_BACKEND
+        else:
+            available = available_backends()
+            _backend = available[0] if available else "bs4"
+    return _backend
+
+
+def parse(html, backend=None):
+    return _DOCUMENTS[backend or backend_name()](html or "")
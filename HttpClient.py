@@ -0,0 +1,51 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:104.0) Gecko/20100101 Firefox/104.0'
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) seconds
+POOL_HOSTS = 64            # how many per-host pools are kept around
+POOL_MAXSIZE = 16          # keep-alive connections kept open per host
+
+
+class HttpClient:
+    def __init__(self, user_agent=USER_AGENT, timeout=DEFAULT_TIMEOUT, pool_hosts=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # make_headers only advertises br/zstd when a decoder for them is installed
+        self.session.headers.update({
+            "User-Agent": user_agent,
+            "Accept-Encoding": make_headers(accept_encoding=True)["accept-encoding"],
+        })
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    # One client per process so every fetch, preview and webhook post reuses the same pools
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
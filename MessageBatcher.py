@@ -0,0 +1,55 @@
+MAX_EMBEDS = 10          # embeds Discord accepts in one webhook message
+MAX_EMBED_CHARS = 6000   # combined text of every embed in one message
+_BATCHABLE_KEYS = frozenset(("username", "avatar_url", "embeds"))
+
+
+def _length(value):
+    return len(str(value)) if value is not None else 0
+
+
+def embed_size(embed):
+    # The characters Discord counts toward MAX_EMBED_CHARS
+    size = _length(embed.get("title")) + _length(embed.get("description"))
+    size += sum(_length(field.get("name")) + _length(field.get("value")) for field in embed.get("fields") or ())
+    size += _length((embed.get("footer") or {}).get("text")) + _length((embed.get("author") or {}).get("name"))
+    return size
+
+
+class Batch:
+    __slots__ = ("webhook_url", "data", "items", "size")
+
+    def __init__(self, webhook_url, data, item):
+        self.webhook_url = webhook_url
+        self.data = data
+        self.items = [item]
+        self.size = sum(embed_size(embed) for embed in data.get("embeds") or ())
+
+
+def batch_messages(messages, max_embeds=MAX_EMBEDS, max_chars=MAX_EMBED_CHARS):
+    # messages is [(webhook_url, data, item)] in queue order; returns a list of Batch, each one
+    # webhook message carrying the embeds of one or more queued messages. Only consecutive
+    # messages for the same webhook with the same username and avatar are merged, so each
+    # channel still sees its posts in order.
+    batches = []
+    open_batches = {}
+    for webhook_url, data, item in messages:
+        embeds = data.get("embeds") or []
+        batchable = bool(embeds) and _BATCHABLE_KEYS.issuperset(data)
+        current = open_batches.get(webhook_url)
+        if batchable and current is not None:
+            size = sum(embed_size(embed) for embed in embeds)
+            same_identity = (data.get("username"), data.get("avatar_url")) == (current.data.get("username"), current.data.get("avatar_url"))
+            if (same_identity and len(current.data["embeds"]) + len(embeds) <= max_embeds
+                    and current.size + size <= max_chars):
+                current.data["embeds"].extend(embeds)
+                current.items.append(item)
+                current.size += size
+                continue
+
+        batch = Batch(webhook_url, dict(data, embeds=list(embeds)) if batchable else data, item)
+        batches.append(batch)
+        if batchable:
+            open_batches[webhook_url] = batch
+        else:
+            open_batches.pop(webhook_url, None)
+    return batches
@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus text exposition (format 0.0.4), without pulling in prometheus_client
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_HOST = "127.0.0.1"  # metrics are served on loopback unless a wider address is asked for
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(list(zip(self.labelnames, key)), value))
+        return lines
+
+    def _samples(self, pairs, value):
+        return [f"{self.name}{_format_labels(pairs)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][position] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, pairs, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_value(float(bound)))])} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labelnames, buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        # For node_exporter's textfile collector in cron mode; the rename keeps readers from
+        # ever seeing a half-written file
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(self.render())
+        os.replace(temporary_path, path)
+
+    def serve(self, port, host=DEFAULT_HOST):
+        # Serves /metrics from a background thread; returns the server so callers can shut it down
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+REGISTRY = Registry()
+
+FETCH_SECONDS = REGISTRY.histogram("discordfeeds_fetch_seconds", "Time to download (and stream-parse) a feed", ("url",))
+FETCH_BYTES = REGISTRY.counter("discordfeeds_fetch_bytes_total", "Feed body bytes read", ("url",))
+FETCH_RESPONSES = REGISTRY.counter("discordfeeds_fetch_responses_total", "Feed fetches by HTTP status, or 'error'", ("url", "status"))
+PARSE_SECONDS = REGISTRY.histogram("discordfeeds_parse_seconds", "Time to find a feed's new entries", ("feed",))
+NEW_ENTRIES = REGISTRY.counter("discordfeeds_new_entries_total", "New entries found", ("feed",))
+PREVIEW_SECONDS = REGISTRY.histogram("discordfeeds_preview_fetch_seconds", "Time to fetch an article page for its preview image", ("site",))
+PREVIEW_LOOKUPS = REGISTRY.counter("discordfeeds_preview_cache_lookups_total", "Preview cache lookups by result", ("result",))
+MONGO_SECONDS = REGISTRY.histogram("discordfeeds_mongo_seconds", "MongoDB operation time", ("op", "collection"))
+MONGO_ERRORS = REGISTRY.counter("discordfeeds_mongo_errors_total", "MongoDB operations that raised", ("op", "collection"))
+WEBHOOK_SECONDS = REGISTRY.histogram("discordfeeds_webhook_post_seconds", "Discord webhook request time", ("webhook",))
+WEBHOOK_RESPONSES = REGISTRY.counter("discordfeeds_webhook_responses_total", "Discord webhook responses by status, or 'error'", ("webhook", "status"))
+RATE_LIMIT_WAIT = REGISTRY.counter("discordfeeds_rate_limit_wait_seconds_total", "Time spent waiting on Discord rate limits", ("webhook", "scope"))
+OUTBOX_MESSAGES = REGISTRY.counter("discordfeeds_outbox_messages_total", "Outbox messages by outcome (sent, retry, failed, superseded)", ("outcome",))
+OUTBOX_PENDING = REGISTRY.gauge("discordfeeds_outbox_pending", "Messages waiting in the outbox")
+PASS_DECISIONS = REGISTRY.counter("discordfeeds_pass_decisions_total", "Due pass reports by decision (changed, heartbeat, unchanged)", ("decision",))
@@ -1,29 +1,111 @@
-from pymongo import MongoClient
+import os
+import threading
+from pymongo import ASCENDING, DESCENDING, DeleteOne, InsertOne, MongoClient, UpdateOne, monitoring
 from bson.objectid import ObjectId
 from datetime import datetime, timedelta
 from pymongo.errors import PyMongoError
+from Metrics import MONGO_ERRORS, MONGO_SECONDS
+
+DEFAULT_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+FLUSH_EVERY = 500  # queued changes before a unit of work writes early
+
+
+class CommandMetrics(monitoring.CommandListener):
+    # Times every command the pooled clients send, by command name and collection
+    def __init__(self):
+        self._collections = {}
+
+    def _collection(self, event):
+        return self._collections.pop((event.connection_id, event.request_id), "")
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, op=event.command_name, collection=self._collection(event))
+
+    def failed(self, event):
+        collection = self._collection(event)
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, op=event.command_name, collection=collection)
+        MONGO_ERRORS.inc(op=event.command_name, collection=collection)
+
 
 class MongoDBHandler:
-    def __init__(self, uri, db_name):
-        self.client = MongoClient(uri)
+    # One pooled MongoClient per uri for the whole process; handlers are cheap views on it
+    _clients = {}
+    _indexed = set()
+    _lock = threading.Lock()
+
+    def __init__(self, uri, db_name, feeds_collection="feeds"):
+        self.client = self.get_client(uri)
         self.db = self.client[db_name]
-        self.feeds = self.db.feeds
+        self.feeds = self.db[feeds_collection]
         self.entries = self.db.entries
         self.passes = self.db.passes
-        print(f"Connected to MongoDB database: {db_name}")
+        self.alerts = self.db.alerts
+        self.ensure_indexes((uri, db_name, feeds_collection))
+
+    @classmethod
+    def get_client(cls, uri):
+        with cls._lock:
+            client = cls._clients.get(uri)
+            if client is None:
+                client = MongoClient(uri, event_listeners=[CommandMetrics()])
+                cls._clients[uri] = client
+                print(f"Connected to MongoDB: {uri}")
+            return client
+
+    @classmethod
+    def use_client(cls, uri, client):
+        # Handlers for uri will share client instead of connecting (e.g. mongomock in the load harness)
+        with cls._lock:
+            cls._clients[uri] = client
+
+    def ensure_indexes(self, key):
+        with self._lock:
+            if key in self._indexed:
+                return
+            self._indexed.add(key)
+        try:
+            # Backs get_last_posted_entry_datetime and the per-name feed updates
+            self.entries.create_index([("feed_name", ASCENDING), ("datetime", DESCENDING)])
+            self.feeds.create_index([("name", ASCENDING)])
+            self.alerts.create_index([("feed_name", ASCENDING), ("alert_id", ASCENDING)], unique=True)
+        except PyMongoError as e:
+            print(f"Failed to create indexes: {e}")
 
     def get_feed_info(self):
+        # Raises on failure: an outage must not look like an empty config, or the daemon drops every feed
         try:
-            return list(self.feeds.find({}))
+            feeds = list(self.feeds.find({}))
             print(f"Found {len(feeds)} feeds in the database.")
-        except:
-            print("Failed to get feed info")
+            return feeds
+        except PyMongoError as e:
+            print(f"Failed to get feed info: {e}")
+            raise
     
     def get_passes(self):
+        # Raises like get_feed_info: with no passes to match, a cycle would mark every report seen unposted
         try:
             return list(self.passes.find({}))
-        except:
-            print("Failed to get passes")
+        except PyMongoError as e:
+            print(f"Failed to get passes: {e}")
+            raise
+
+    def get_alerts(self, feed_name):
+        # {alert id: document} for the alerts a feed is tracking
+        try:
+            return {alert['alert_id']: alert for alert in self.alerts.find({"feed_name": feed_name})}
+        except PyMongoError as e:
+            print(f"Failed to get alerts: {e}")
+            return None
+
+    def update_feed(self, feed_name, values):
+        try:
+            self.feeds.update_one({"name": feed_name}, {"$set": values})
+        except PyMongoError as e:
+            print(f"An error occurred: {e}")
 
     def get_last_posted_entry_datetime(self, feed_name):
         entry = self.entries.find_one({"feed_name": feed_name}, sort=[("datetime", -1)])
@@ -70,4 +152,81 @@ class MongoDBHandler:
             else:
                 print("Document updated successfully.")
         except PyMongoError as e:
-            print(f"An error occurred: {e}")
\ No newline at end of file
+            print(f"An error occurred: {e}")
+
+    def unit_of_work(self, flush_every=FLUSH_EVERY):
+        return UnitOfWork(self, flush_every)
+
+
+class UnitOfWork:
+    # Collects a cycle's state changes and writes them with one ordered bulk_write per
+    # collection, at the end of the cycle or every flush_every changes
+    def __init__(self, handler, flush_every=FLUSH_EVERY):
+        self.handler = handler
+        self.flush_every = flush_every
+        self._passes = None
+        self._pending = {}
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # A cycle that raised writes none of its queued changes, so its feeds are read again in full
+        # next time rather than half-saved (e.g. new validators without the seen state)
+        if exc_type is None:
+            self.flush()
+        elif self._count:
+            print(f"Discarding {self._count} unwritten changes after an error: {exc_value}")
+            self._pending = {}
+            self._count = 0
+
+    @property
+    def passes(self):
+        # Reference data is read once per cycle; updates below are applied to it in place
+        if self._passes is None:
+            self._passes = self.handler.get_passes()
+        return self._passes
+
+    def update_feed(self, feed_name, values, document=None):
+        # Passing the loaded feed document keeps it in step for callers that hold on to it
+        if document is not None:
+            document.update(values)
+        self._add(self.handler.feeds, UpdateOne({"name": feed_name}, {"$set": values}))
+
+    def update_feed_by_id(self, id, values, document=None):
+        if document is not None:
+            document.update(values)
+        self._add(self.handler.feeds, UpdateOne({'_id': ObjectId(id)}, {"$set": values}))
+
+    def update_pass(self, id, values):
+        if self._passes is not None:
+            for wa_pass in self._passes:
+                if wa_pass['_id'] == id:
+                    wa_pass.update(values)
+        self._add(self.handler.passes, UpdateOne({'_id': ObjectId(id)}, {"$set": values}))
+
+    def save_alert(self, feed_name, alert_id, values):
+        self._add(self.handler.alerts, UpdateOne({"feed_name": feed_name, "alert_id": alert_id}, {"$set": values}, upsert=True))
+
+    def delete_alert(self, feed_name, alert_id):
+        self._add(self.handler.alerts, DeleteOne({"feed_name": feed_name, "alert_id": alert_id}))
+
+    def save_new_entry(self, feed_name, entry_datetime):
+        self._add(self.handler.entries, InsertOne({"feed_name": feed_name, "datetime": entry_datetime}))
+
+    def _add(self, collection, operation):
+        self._pending.setdefault(collection.name, (collection, []))[1].append(operation)
+        self._count += 1
+        if self._count >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        pending = self._pending
+        self._pending = {}
+        self._count = 0
+        for collection, operations in pending.values():
+            try:
+                collection.bulk_write(operations, ordered=True)
+            except PyMongoError as e:
+                print(f"Failed to write {len(operations)} changes to {collection.name}: {e}")
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from DiscordDispatcher import get_dispatcher
+from MessageBatcher import Batch, batch_messages
+from Metrics import OUTBOX_MESSAGES, OUTBOX_PENDING
+
+OUTBOX_PATH = "outbox.sqlite"
+MAX_ATTEMPTS = 8             # posts before a message is given up on
+BASE_BACKOFF = 5             # seconds before the first retry, doubling after each failure
+MAX_BACKOFF = 1800           # longest wait between retries
+RETAIN = 7 * 24 * 3600       # seconds sent and failed rows are kept, so a replayed entry is still recognised
+POLL_INTERVAL = 1.0          # how often the worker looks for retries coming due
+PRUNE_INTERVAL = 3600        # how often a long-running worker drops rows older than retain
+BATCH = 100                  # messages handed to the dispatcher per pass
+BATCH_WINDOW = 2.0           # seconds a new message waits for others to share its webhook post
+LEASE = 300                  # seconds a claimed message is left to the process posting it before another may
+
+
+# track: posted on its own with wait=true; parent: key of the message whose Discord message this
+# one edits; target: the Discord message to edit if parent is gone; message_id: the Discord message
+# this one created or edited, once sent; lease_until: until when a process posting it holds the claim;
+# superseded_by: the newer edit that replaced this one before it was sent
+_ADDED_COLUMNS = (("track", "INTEGER NOT NULL DEFAULT 0"), ("parent", "TEXT"), ("target", "TEXT"), ("message_id", "TEXT"),
+                  ("lease_until", "REAL"), ("superseded_by", "TEXT"))
+
+
+def message_key(webhook_url, key):
+    return hashlib.blake2b(f"{webhook_url}|{key}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Outbox:
+    # Durable queue between the feed scripts and Discord. Messages are committed to SQLite
+    # before a feed's seen state is saved, and a worker posts them through the dispatcher,
+    # retrying with exponential backoff, so a Discord outage or a restart doesn't lose posts.
+    # Messages queued for the same webhook within batch_window go out as one multi-embed post.
+    # Tracked messages (enqueue with track=True, and edits) go out on their own and remember the
+    # Discord message they created or edited, so later revisions can edit it in place.
+    # Several processes can share one outbox file (the cron scripts run side by side): a message is
+    # claimed with a lease before it is posted, so only one of them posts it.
+    def __init__(self, path=OUTBOX_PATH, dispatcher=None, max_attempts=MAX_ATTEMPTS, base_backoff=BASE_BACKOFF,
+                 max_backoff=MAX_BACKOFF, retain=RETAIN, batch_window=BATCH_WINDOW):
+        self.dispatcher = dispatcher or get_dispatcher()
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.retain = retain
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._in_flight = set()
+        self._solo = set()   # keys whose merged post was rejected; they go out on their own
+        self._worker = None
+        self._stopping = False
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("BEGIN IMMEDIATE")
+        self._db.execute("CREATE TABLE IF NOT EXISTS messages (key TEXT PRIMARY KEY, webhook TEXT NOT NULL, payload TEXT NOT NULL, "
+                         "attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, created_at REAL NOT NULL, "
+                         "sent_at REAL, failed INTEGER NOT NULL DEFAULT 0, last_error TEXT)")
+        # Outboxes from older versions get the newer columns added
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(messages)")}
+        for column, definition in _ADDED_COLUMNS:
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE messages ADD COLUMN {column} {definition}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_due ON messages (sent_at, failed, next_attempt)")
+        self._db.commit()
+
+    def enqueue(self, webhook_url, data, key=None, track=False):
+        # key identifies the entry being posted; the same key for the same webhook is only ever
+        # queued once, so re-detecting an entry after a crash doesn't post it twice.
+        # With track the message's Discord id is kept (see message_id) for later edits.
+        # Returns False when the message was already queued or sent.
+        if key is None:
+            key = json.dumps(data, sort_keys=True)
+        return self._insert(webhook_url, data, key, int(track), None, None)
+
+    def enqueue_edit(self, webhook_url, data, key, parent_key=None, message_id=None):
+        # Replaces the Discord message that parent_key's message created or last edited. While the
+        # parent is still queued the edit waits for it; if the parent is gone or failed, message_id
+        # is edited instead, and without one the edit is posted as a new (tracked) message.
+        # A parent that is still unsent and unclaimed is superseded: only the latest payload goes out,
+        # in the parent's place.
+        parent = message_key(webhook_url, parent_key) if parent_key is not None else None
+        return self._insert(webhook_url, data, key, 1, parent, message_id, supersede=True)
+
+    def message_id(self, webhook_url, key):
+        # The Discord message a sent tracked message created or edited, or None
+        with self._lock:
+            row = self._db.execute("SELECT message_id FROM messages WHERE key = ?", (message_key(webhook_url, key),)).fetchone()
+        return row[0] if row else None
+
+    def _insert(self, webhook_url, data, key, track, parent, target, supersede=False):
+        now = time.time()
+        key = message_key(webhook_url, key)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                superseded = None
+                if supersede and parent is not None and parent not in self._in_flight:
+                    replaced = self._db.execute("SELECT parent, target FROM messages WHERE key = ? AND track = 1 "
+                                                "AND sent_at IS NULL AND failed = 0 AND superseded_by IS NULL "
+                                                "AND (lease_until IS NULL OR lease_until < ?)", (parent, now)).fetchone()
+                    if replaced is not None:
+                        # The edit takes over what the superseded message would have edited (or posted)
+                        superseded, parent, target = parent, replaced[0], target or replaced[1]
+                cursor = self._db.execute("INSERT OR IGNORE INTO messages (key, webhook, payload, next_attempt, created_at, track, "
+                                          "parent, target) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                          (key, webhook_url, json.dumps(data), now + self.batch_window, now, track, parent, target))
+                inserted = cursor.rowcount == 1
+                if inserted and superseded is not None:
+                    self._db.execute("UPDATE messages SET superseded_by = ? WHERE key = ?", (key, superseded))
+                self._db.commit()
+            except sqlite3.Error:
+                self._db.rollback()
+                raise
+        if inserted and superseded is not None:
+            OUTBOX_MESSAGES.inc(outcome="superseded")
+        self._wake.set()
+        return inserted
+
+    def pending(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM messages WHERE sent_at IS NULL AND failed = 0 AND superseded_by IS NULL").fetchone()[0]
+
+    def start(self):
+        with self._lock:
+            if self._worker is None:
+                self._stopping = False
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def drain(self, due_by=None):
+        # Hands every message due by due_by (default now) to the dispatcher, packed into as few
+        # webhook posts as Discord's limits allow; returns how many messages were sent off
+        with self._lock:
+            now = time.time()
+            # Selecting and claiming happen in one write transaction, so another process sharing the
+            # file can't pick the same rows. An edit whose parent is still queued waits; once the parent
+            # is sent its message is the one edited, and if the parent failed or was pruned the edit
+            # falls back to its own target
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute("SELECT m.key, m.webhook, m.payload, m.attempts, m.track, COALESCE(p.message_id, m.target) "
+                                        "FROM messages m LEFT JOIN messages p ON p.key = m.parent "
+                                        "WHERE m.sent_at IS NULL AND m.failed = 0 AND m.superseded_by IS NULL AND m.next_attempt <= ? "
+                                        "AND (m.lease_until IS NULL OR m.lease_until < ?) "
+                                        "AND (p.key IS NULL OR p.sent_at IS NOT NULL OR p.failed = 1) "
+                                        "ORDER BY m.created_at LIMIT ?",
+                                        (due_by or now, now, BATCH + len(self._in_flight))).fetchall()
+                rows = [row for row in rows if row[0] not in self._in_flight][:BATCH]
+                self._db.executemany("UPDATE messages SET lease_until = ? WHERE key = ?", [(now + LEASE, row[0]) for row in rows])
+                self._db.commit()
+            except sqlite3.Error:
+                self._db.rollback()
+                raise
+            OUTBOX_PENDING.set(self._db.execute("SELECT COUNT(*) FROM messages WHERE sent_at IS NULL AND failed = 0 AND superseded_by IS NULL").fetchone()[0])
+            self._in_flight.update(row[0] for row in rows)
+            solo = set(self._solo)
+
+        batches = batch_messages([(webhook_url, json.loads(payload), (key, attempts))
+                                  for key, webhook_url, payload, attempts, track, _ in rows if key not in solo and not track])
+        batches += [Batch(webhook_url, json.loads(payload), (key, attempts))
+                    for key, webhook_url, payload, attempts, track, _ in rows if key in solo and not track]
+        for batch in batches:
+            future = self.dispatcher.submit(batch.webhook_url, batch.data)
+            future.add_done_callback(lambda future, items=batch.items: self._finished(items, future))
+        for key, webhook_url, payload, attempts, track, target in rows:
+            if track:
+                future = self.dispatcher.submit(webhook_url, json.loads(payload), message_id=target, wait=True)
+                future.add_done_callback(lambda future, items=[(key, attempts)], target=target:
+                                         self._finished(items, future, True, target))
+        return len(rows)
+
+    def flush(self):
+        # Posts everything due now, without waiting out the batch window, and waits for it.
+        # Messages backing off after a failure stay queued for the worker or the next run.
+        while True:
+            sent = self.drain(time.time() + self.batch_window)
+            with self._lock:
+                while self._in_flight:
+                    self._idle.wait()
+            if not sent:
+                return
+
+    def close(self):
+        with self._lock:
+            worker = self._worker
+            self._worker = None
+            self._stopping = True
+        self._wake.set()
+        if worker is not None:
+            worker.join()
+        self.flush()
+        self.dispatcher.close()
+        self.prune()
+
+    def prune(self):
+        with self._lock:
+            self._db.execute("DELETE FROM messages WHERE (sent_at IS NOT NULL OR failed = 1 OR superseded_by IS NOT NULL) AND created_at < ?",
+                             (time.time() - self.retain,))
+            self._db.commit()
+
+    def _run(self):
+        # The daemon only closes its outbox at shutdown, so the worker prunes as it goes
+        next_prune = time.monotonic()
+        while not self._stopping:
+            try:
+                self.drain()
+                if time.monotonic() >= next_prune:
+                    self.prune()
+                    next_prune = time.monotonic() + PRUNE_INTERVAL
+            except sqlite3.OperationalError as e:
+                # Another process held the file past the timeout; try again on the next pass
+                print(f"Outbox busy: {e}")
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+    def _finished(self, items, future, track=False, target=None):
+        message_id = target
+        try:
+            response = future.result()
+            status = response.status_code
+            error = None if status in (200, 204) else f"HTTP {status}"
+            if track and error is None and target is None:
+                message_id = self._created_id(response)
+        except Exception as e:
+            status = None
+            error = str(e)
+
+        # Other 4xx answers (bad payload, deleted webhook) won't change on a retry
+        permanent = status is not None and 400 <= status < 500 and status != 429
+        now = time.time()
+        with self._lock:
+            for key, attempts in items:
+                attempts += 1
+                if error is None:
+                    OUTBOX_MESSAGES.inc(outcome="sent")
+                    self._db.execute("UPDATE messages SET sent_at = ?, attempts = ?, last_error = NULL, message_id = ?, lease_until = NULL WHERE key = ?",
+                                     (now, attempts, message_id, key))
+                elif target is not None and status == 404:
+                    # The message being edited was deleted in Discord: post the edit as a new message
+                    print(f"Message {target} is gone, posting its update as a new message")
+                    OUTBOX_MESSAGES.inc(outcome="retry")
+                    self._db.execute("UPDATE messages SET attempts = ?, next_attempt = ?, last_error = ?, parent = NULL, target = NULL, "
+                                     "lease_until = NULL WHERE key = ?", (attempts, now, error, key))
+                elif permanent and len(items) > 1:
+                    # One bad embed shouldn't sink the rest: retry each message on its own right away
+                    self._solo.add(key)
+                    OUTBOX_MESSAGES.inc(outcome="retry")
+                    self._db.execute("UPDATE messages SET attempts = ?, next_attempt = ?, last_error = ?, lease_until = NULL WHERE key = ?",
+                                     (attempts, now, error, key))
+                elif permanent or attempts >= self.max_attempts:
+                    print(f"Giving up on message after {attempts} attempts: {error}")
+                    OUTBOX_MESSAGES.inc(outcome="failed")
+                    self._db.execute("UPDATE messages SET failed = 1, attempts = ?, last_error = ?, lease_until = NULL WHERE key = ?", (attempts, error, key))
+                else:
+                    delay = min(self.base_backoff * 2 ** (attempts - 1), self.max_backoff)
+                    print(f"Retrying message in {delay:.0f}s: {error}")
+                    OUTBOX_MESSAGES.inc(outcome="retry")
+                    self._db.execute("UPDATE messages SET attempts = ?, next_attempt = ?, last_error = ?, lease_until = NULL WHERE key = ?",
+                                     (attempts, now + delay, error, key))
+                self._in_flight.discard(key)
+                if error is None:
+                    self._solo.discard(key)
+            self._db.commit()
+            self._idle.notify_all()
+
+    @staticmethod
+    def _created_id(response):
+        try:
+            return str(response.json()["id"])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+        return _outbox
@@ -0,0 +1,70 @@
+import hashlib
+import os
+from datetime import timedelta
+
+# WSDoT re-publishes every pass report every few minutes whether or not anything changed. A pass is
+# only posted again when its report or its camera image differs from what the last post carried, or
+# when nothing has been posted for Max_Staleness hours (a heartbeat, so a quiet pass still shows up).
+# Frequency stays the shortest gap between two posts of the same pass.
+MAX_STALENESS_HOURS = float(os.environ.get("PASS_MAX_STALENESS_HOURS", 12))
+HASH_FIELDS = ("Summary_Hash", "Camera_Hash")
+
+
+def pass_status(entry):
+    return "Closed" if 'closed' in entry.summary.lower() else "Open"
+
+
+def summary_hash(summary, status):
+    # The report time is left out, since it moves on with every re-publish
+    fields = (summary.temperature, summary.directions, summary.conditions, summary.weather, status)
+    return hashlib.sha256(repr(fields).encode()).hexdigest()
+
+
+def camera_validators(wa_pass):
+    return wa_pass.get('Camera_ETag'), wa_pass.get('Camera_Last_Modified')
+
+
+def camera_url(camera, version):
+    # The image version in the url makes Discord fetch the picture again only when it has changed
+    if not version:
+        return camera
+    return f"{camera}{'&' if '?' in camera else '?'}v={version[:16]}"
+
+
+class PassState:
+    # What a post of wa_pass would carry now. camera is the FetchResult of a conditional GET of the
+    # camera image; a 304 or a failed fetch keeps the stored camera hash.
+    def __init__(self, wa_pass, summary, status, camera=None):
+        self.values = {
+            'Summary_Hash': summary_hash(summary, status),
+            'Camera_Hash': wa_pass.get('Camera_Hash'),
+            'Camera_ETag': wa_pass.get('Camera_ETag'),
+            'Camera_Last_Modified': wa_pass.get('Camera_Last_Modified'),
+        }
+        if camera is not None and camera.ok:
+            self.values.update({
+                'Camera_Hash': hashlib.sha256(camera.content).hexdigest(),
+                'Camera_ETag': camera.etag,
+                'Camera_Last_Modified': camera.last_modified,
+            })
+
+    @property
+    def camera_version(self):
+        return self.values['Camera_Hash']
+
+    def changed(self, wa_pass):
+        return [field for field in HASH_FIELDS if self.values[field] != wa_pass.get(field)]
+
+    def updates(self, wa_pass):
+        # Stored fields that differ, worth writing even when nothing is posted (e.g. a new ETag)
+        return {field: value for field, value in self.values.items() if value != wa_pass.get(field)}
+
+    def reason(self, wa_pass, now):
+        # "changed", "heartbeat", or None when the post would repeat the last one
+        if self.changed(wa_pass):
+            return "changed"
+        last_posted = wa_pass.get('Last_Posted')
+        max_staleness = timedelta(hours=wa_pass.get('Max_Staleness', MAX_STALENESS_HOURS))
+        if last_posted is None or now - last_posted >= max_staleness:
+            return "heartbeat"
+        return None
@@ -0,0 +1,93 @@
+import re
+from collections import defaultdict
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+MIN_PREFIX = 3  # shortest title word that may match the start of a longer pass name word
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def normalize_name(text):
+    return " ".join(tokenize(text))
+
+
+class PassIndex:
+    # Built once per cycle from WSDotPasses.json or the passes collection. Lookups go through
+    # token and prefix maps instead of scanning every pass for every entry.
+    def __init__(self, passes):
+        self.passes = list(passes)
+        self._by_name = {}
+        self._name_tokens = defaultdict(set)
+        self._name_prefixes = defaultdict(set)
+        self._location_tokens = defaultdict(set)
+        self._phrases = []
+
+        for position, wa_pass in enumerate(self.passes):
+            name = normalize_name(wa_pass.get('Pass'))
+            self._by_name.setdefault(name, position)
+            self._phrases.append(f" {name} ")
+            for token in set(tokenize(wa_pass.get('Pass'))):
+                self._name_tokens[token].add(position)
+                for end in range(MIN_PREFIX, len(token)):
+                    self._name_prefixes[token[:end]].add(position)
+            for token in set(tokenize(wa_pass.get('Location'))):
+                self._location_tokens[token].add(position)
+
+    def _is_generic(self, postings):
+        # A word on more than a quarter of the passes ("pass") can't pick a pass by itself
+        return len(postings) > 1 and len(postings) * 4 > len(self.passes)
+
+    def __len__(self):
+        return len(self.passes)
+
+    def get(self, name):
+        # Exact lookup by pass name, ignoring case and punctuation
+        position = self._by_name.get(normalize_name(name))
+        return self.passes[position] if position is not None else None
+
+    def _weight(self, token, postings):
+        # Words shared by many passes ("pass", "us", "sr") count for little
+        return 1.0 / len(postings[token])
+
+    def match(self, title):
+        title_tokens = tokenize(title)
+        if not title_tokens:
+            return None
+        padded_title = f" {' '.join(title_tokens)} "
+
+        scores = defaultdict(float)
+        first_hit = {}
+        generic_hits = []
+        for order, token in enumerate(title_tokens):
+            if token in self._name_tokens:
+                postings, weight = self._name_tokens[token], 10 * self._weight(token, self._name_tokens)
+            elif token in self._name_prefixes:
+                postings, weight = self._name_prefixes[token], 5 * self._weight(token, self._name_prefixes)
+            else:
+                continue
+            if self._is_generic(postings):
+                generic_hits.append((postings, weight))
+                continue
+            for position in postings:
+                scores[position] += weight
+                first_hit.setdefault(position, order)
+
+        if not scores:
+            return None
+
+        for postings, weight in generic_hits:
+            for position in postings:
+                if position in scores:
+                    scores[position] += weight
+        for position in scores:
+            if self._phrases[position] in padded_title:
+                scores[position] += 100
+            for token in title_tokens:
+                if token in self._location_tokens and position in self._location_tokens[token]:
+                    scores[position] += self._weight(token, self._location_tokens)
+
+        # Highest score wins; ties go to the pass named earliest in the title, then list order
+        best = min(scores, key=lambda position: (-scores[position], first_hit[position], position))
+        return self.passes[best]
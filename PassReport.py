@@ -0,0 +1,54 @@
+import re
+from datetime import datetime
+from functools import lru_cache
+
+# Every field in a WSDoT pass summary is "<strong>Label</strong>" followed by "<br />" or "&nbsp;"
+# and a plain-text value that runs to the next "<br"; one scan over these pieces fills the whole report.
+# The break is matched loosely since streamed summaries aren't normalised to "<br />" like feedparser's.
+_FIELD_RE = re.compile(r'<strong>([^<]*)</strong>(?:<br ?/?>|&nbsp;)([^<]*)<br')
+_DIRECTIONS = frozenset(("Eastbound", "Westbound", "Northbound", "Southbound"))
+_LABELS = _DIRECTIONS | {"Temperature:", "Conditions:", "Weather:"}
+
+
+class PassReport:
+    __slots__ = ("name", "datetime", "temperature", "directions", "conditions", "weather")
+
+    def __init__(self, name=None, datetime=None, temperature=None, directions=None, conditions=None, weather=None):
+        self.name = name
+        self.datetime = datetime
+        self.temperature = temperature
+        self.directions = directions if directions is not None else []
+        self.conditions = conditions
+        self.weather = weather
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"PassReport({fields})"
+
+
+@lru_cache(maxsize=256)
+def _parse_datetime(value):
+    try:
+        return datetime.strptime(value, '%m/%d/%Y %I:%M %p')
+    except ValueError:
+        return None
+
+
+def parse_pass_summary(data_string):
+    # Missing fields stay None (or an empty directions list) instead of raising
+    report = PassReport()
+    for label, value in _FIELD_RE.findall(data_string):
+        if label not in _LABELS:
+            # The pass name comes first, with the report time under it
+            if report.name is None:
+                report.name = label
+                report.datetime = _parse_datetime(value)
+        elif label == "Temperature:":
+            report.temperature = value.removesuffix("&deg;F") + "°F"
+        elif label in _DIRECTIONS:
+            report.directions.append((label, value))
+        elif label == "Conditions:":
+            report.conditions = value
+        elif label == "Weather:":
+            report.weather = value
+    return report
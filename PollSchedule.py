@@ -0,0 +1,56 @@
+MIN_INTERVAL = 60         # seconds; never poll a feed more often than this
+MAX_INTERVAL = 3600       # seconds; never leave a feed longer than this
+POLLS_PER_GAP = 2         # aim to poll about twice per expected gap between new entries
+SMOOTHING = 0.3           # weight of the newest gap in the running average
+IDLE_BACKOFF = 1.5        # interval growth per empty poll or 304
+ERROR_BACKOFF = 2.0       # interval growth per failed poll
+BURST_RATIO = 4           # a gap this many times shorter than usual starts a burst
+BURST_ENTRIES = 3         # or this many new entries in a single poll
+
+
+class AdaptiveInterval:
+    # Per-feed poll interval learned from how often new entries actually show up.
+    # Quiet feeds and failing feeds back off exponentially, bursts snap back down at once.
+    def __init__(self, interval, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = self.clamp(interval)
+        self.mean_gap = None
+        self.last_arrival = None
+        self.errors = 0
+
+    def clamp(self, interval):
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def set_bounds(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = self.clamp(self.interval)
+
+    def observe(self, now, new_entries=0, error=False):
+        # Called after every poll; returns the delay until the next one
+        if error:
+            self.errors += 1
+            self.interval = self.clamp(self.interval * ERROR_BACKOFF)
+            return self.interval
+        self.errors = 0
+
+        if not new_entries:
+            self.interval = self.clamp(self.interval * IDLE_BACKOFF)
+            return self.interval
+
+        if self.last_arrival is not None:
+            gap = (now - self.last_arrival) / new_entries
+            burst = new_entries >= BURST_ENTRIES or (self.mean_gap is not None and gap * BURST_RATIO < self.mean_gap)
+            if self.mean_gap is None or burst:
+                self.mean_gap = gap
+            else:
+                self.mean_gap += SMOOTHING * (gap - self.mean_gap)
+            target = self.mean_gap / POLLS_PER_GAP
+            if burst:
+                target = min(target, self.interval / BURST_RATIO)
+            self.interval = self.clamp(target)
+        elif new_entries >= BURST_ENTRIES:
+            self.interval = self.clamp(self.interval / BURST_RATIO)
+        self.last_arrival = now
+        return self.interval
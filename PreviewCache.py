@@ -0,0 +1,131 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from Metrics import PREVIEW_LOOKUPS
+
+CACHE_PATH = "preview_cache.sqlite"
+TTL = 7 * 24 * 3600          # seconds a resolved preview is trusted
+NEGATIVE_TTL = 3600          # seconds a failed fetch is remembered before retrying
+MAX_ENTRIES = 50000          # rows kept on disk
+MEMORY_ENTRIES = 1024        # rows kept in the in-memory LRU
+EVICT_EVERY = 100            # writes between disk size checks
+
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid")
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith(TRACKING_PARAMS)]
+    return urlunsplit((scheme, netloc, parts.path or "/", urlencode(sorted(query)), ""))
+
+
+class PreviewCache:
+    def __init__(self, path=CACHE_PATH, ttl=TTL, negative_ttl=NEGATIVE_TTL, max_entries=MAX_ENTRIES, memory_entries=MEMORY_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self._memory = OrderedDict()
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS previews (url TEXT PRIMARY KEY, image_url TEXT, failed INTEGER NOT NULL, expires_at REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS previews_expires_at ON previews (expires_at)")
+        self._db.commit()
+
+    def get(self, url):
+        # Returns (found, image_url); a cached failure is found with image_url None
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and cached[1] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                PREVIEW_LOOKUPS.inc(result="memory_hit")
+                return True, cached[0]
+
+            row = self._db.execute("SELECT image_url, expires_at FROM previews WHERE url = ?", (key,)).fetchone()
+            if row is not None and row[1] > now:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                self.disk_hits += 1
+                PREVIEW_LOOKUPS.inc(result="disk_hit")
+                return True, row[0]
+
+            self._memory.pop(key, None)
+            self.misses += 1
+            PREVIEW_LOOKUPS.inc(result="miss")
+            return False, None
+
+    def set(self, url, image_url):
+        self._store(url, image_url, False, self.ttl)
+
+    def set_failure(self, url):
+        self._store(url, None, True, self.negative_ttl)
+
+    def stats(self):
+        with self._lock:
+            size = self._db.execute("SELECT COUNT(*) FROM previews").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "memory_size": len(self._memory),
+            "disk_size": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _store(self, url, image_url, failed, ttl):
+        key = normalize_url(url)
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._remember(key, image_url, expires_at)
+            self._db.execute("INSERT OR REPLACE INTO previews (url, image_url, failed, expires_at) VALUES (?, ?, ?, ?)",
+                             (key, image_url, int(failed), expires_at))
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict()
+            self._db.commit()
+
+    def _remember(self, key, image_url, expires_at):
+        self._memory[key] = (image_url, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        self._db.execute("DELETE FROM previews WHERE expires_at <= ?", (time.time(),))
+        overflow = self._db.execute("SELECT COUNT(*) FROM previews").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            # Drop the rows closest to expiring first
+            self._db.execute("DELETE FROM previews WHERE url IN (SELECT url FROM previews ORDER BY expires_at LIMIT ?)", (overflow,))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_preview_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PreviewCache()
+        return _cache
@@ -0,0 +1,147 @@
+import codecs
+from html.parser import HTMLParser
+
+from HttpClient import get_http_client
+
+# Per-site rules for picking the preview image when the page has no og:/twitter: image
+RULE_PICTURE_IMG_WITHOUT_ALT = "picture_img_without_alt"  # NPR: first img without alt after the first <picture>
+RULE_IMG_AFTER_TITLE = "img_after_title"                  # Ars/Tumblr: first img after <title>
+RULE_CAMERA_DIV = "camera_div"                            # WSDoT: img inside the first div.flat-camera-image
+
+CHUNK_SIZE = 16 * 1024
+MAX_BYTES = 1024 * 1024
+
+
+class _Found(Exception):
+    pass
+
+
+class PreviewParser(HTMLParser):
+    def __init__(self, rule, prefer_meta=True):
+        super().__init__(convert_charrefs=True)
+        self.rule = rule
+        self.prefer_meta = prefer_meta
+        self.in_head = True
+        self.og_image = None
+        self.twitter_image = None
+        self.rule_image = None
+        self.rule_done = False
+        self.seen_title = False
+        self.seen_picture = False
+        self.camera_depth = 0
+        self.result = None
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "meta":
+            if self.prefer_meta and self.in_head:
+                self._meta(dict(attrs))
+            return
+        if tag == "body":
+            self._end_head()
+            return
+        if self.rule_done:
+            return
+
+        if self.rule == RULE_IMG_AFTER_TITLE:
+            if tag == "title":
+                self.seen_title = True
+            elif tag == "img" and self.seen_title:
+                self._rule_match(dict(attrs).get("src"))
+        elif self.rule == RULE_PICTURE_IMG_WITHOUT_ALT:
+            if tag == "picture":
+                self.seen_picture = True
+            elif tag == "img" and self.seen_picture:
+                attrs = dict(attrs)
+                if not attrs.get("alt") and attrs.get("src"):
+                    self._rule_match(attrs["src"])
+        elif self.rule == RULE_CAMERA_DIV:
+            if tag == "div":
+                if self.camera_depth:
+                    self.camera_depth += 1
+                elif "flat-camera-image" in (dict(attrs).get("class") or "").split():
+                    self.camera_depth = 1
+            elif tag == "img" and self.camera_depth:
+                self._rule_match(dict(attrs).get("src"))
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self._end_head()
+        elif tag == "div" and self.camera_depth and not self.rule_done:
+            self.camera_depth -= 1
+            if not self.camera_depth:
+                # Only the first camera div counts, same as soup.find
+                self._rule_match(None)
+
+    def _meta(self, attrs):
+        key = (attrs.get("property") or attrs.get("name") or "").lower()
+        content = attrs.get("content")
+        if not content:
+            return
+        if key == "og:image" and not self.og_image:
+            self.og_image = content
+            self._finish(content)
+        elif key in ("twitter:image", "twitter:image:src") and not self.twitter_image:
+            self.twitter_image = content
+
+    def _end_head(self):
+        if not self.in_head:
+            return
+        self.in_head = False
+        if self.twitter_image:
+            self._finish(self.twitter_image)
+        if self.rule_done:
+            self._finish(self.rule_image)
+
+    def _rule_match(self, image_url):
+        self.rule_done = True
+        self.rule_image = image_url or None
+        # While still in <head> a meta tag may yet override the per-site rule
+        if not (self.prefer_meta and self.in_head):
+            self._finish(self.rule_image)
+
+    def _finish(self, image_url):
+        self.result = image_url
+        self.done = True
+        raise _Found()
+
+    def best_effort(self):
+        if self.done:
+            return self.result
+        return self.og_image or self.twitter_image or self.rule_image
+
+
+def parse_preview(chunks, rule, prefer_meta=True):
+    # chunks is an iterable of decoded text; parsing stops at the first definite match
+    parser = PreviewParser(rule, prefer_meta)
+    for chunk in chunks:
+        try:
+            parser.feed(chunk)
+        except _Found:
+            return parser.result
+    try:
+        parser.close()
+    except _Found:
+        return parser.result
+    return parser.best_effort()
+
+
+def _decoded_chunks(response, max_bytes):
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    read = 0
+    for chunk in response.iter_content(CHUNK_SIZE):
+        yield decoder.decode(chunk)
+        read += len(chunk)
+        if read >= max_bytes:
+            return
+
+
+def fetch_preview_image(url, rule, prefer_meta=True, max_bytes=MAX_BYTES, client=None):
+    client = client or get_http_client()
+    response = client.get(url, stream=True)
+    try:
+        response.raise_for_status()
+        return parse_preview(_decoded_chunks(response, max_bytes), rule, prefer_meta)
+    finally:
+        # Closing drops the rest of the body instead of downloading it
+        response.close()
@@ -0,0 +1,133 @@
+import base64
+import hashlib
+import json
+from collections import deque
+
+RING_SIZE = 500           # recent entry keys remembered per feed
+BLOOM_BITS = 1 << 16      # 8 KiB filter, ~1% false positives at ~6800 keys
+BLOOM_HASHES = 5
+
+
+def entry_key(entry, include_updated=False):
+    # Short stable hash of the entry id; include_updated makes revisions of the same entry count as new
+    entry_id = entry.get("id", entry.link)  # Using link as a fallback identifier
+    if include_updated:
+        entry_id = f"{entry_id}|{entry.get('updated', '')}"
+    return hashlib.blake2b(entry_id.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class BloomFilter:
+    def __init__(self, bits=BLOOM_BITS, hashes=BLOOM_HASHES, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray(bits // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.data[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def to_string(self):
+        return base64.b64encode(bytes(self.data)).decode("ascii")
+
+    @classmethod
+    def from_string(cls, value, bits=BLOOM_BITS, hashes=BLOOM_HASHES):
+        return cls(bits, hashes, base64.b64decode(value))
+
+
+class SeenIndex:
+    # A bounded ring of recent entry keys (plus an optional Bloom filter for older ones).
+    # New entries are found by set membership, so removed or reordered entries don't cause reposts.
+    def __init__(self, keys=(), size=RING_SIZE, bloom=None, legacy_last_seen=None, key=entry_key):
+        self.ring = deque(keys, maxlen=size)
+        self.keys = set(self.ring)
+        self.bloom = bloom
+        self.legacy_last_seen = legacy_last_seen
+        self.key = key
+        self.changed = False
+
+    def __contains__(self, key):
+        return key in self.keys or (self.bloom is not None and key in self.bloom)
+
+    def __len__(self):
+        return len(self.ring)
+
+    def add(self, key):
+        if key in self.keys:
+            return
+        if len(self.ring) == self.ring.maxlen:
+            self.keys.discard(self.ring[0])
+        self.ring.append(key)
+        self.keys.add(key)
+        if self.bloom is not None:
+            self.bloom.add(key)
+        self.changed = True
+
+    def new_entries(self, entries):
+        if not self.ring and self.legacy_last_seen is not None:
+            return self._new_entries_from_legacy(entries)
+
+        new_entries = []
+        batch = set()
+        for entry in entries:
+            key = self.key(entry)
+            if key not in self and key not in batch:
+                batch.add(key)
+                new_entries.append(entry)
+        return new_entries
+
+    def _new_entries_from_legacy(self, entries):
+        # First run after moving off a single last_seen id: keep the old positional cut once
+        # and remember everything from the marker on as already posted
+        new_entries = []
+        for position, entry in enumerate(entries):
+            if entry.get("id", entry.link) == self.legacy_last_seen:
+                for old_entry in entries[position:]:
+                    self.add(self.key(old_entry))
+                break
+            new_entries.append(entry)
+        self.legacy_last_seen = None
+        return new_entries
+
+    def mark_seen(self, entries):
+        # Oldest first, so the newest keys are the last to fall out of the ring
+        for entry in reversed(entries):
+            self.add(self.key(entry))
+
+    def to_document(self):
+        return {
+            "keys": list(self.ring),
+            "bloom": self.bloom.to_string() if self.bloom is not None else None,
+        }
+
+    @classmethod
+    def from_document(cls, document, use_bloom=False, legacy_last_seen=None, key=entry_key):
+        document = document or {}
+        bloom = None
+        if document.get("bloom"):
+            bloom = BloomFilter.from_string(document["bloom"])
+        elif use_bloom:
+            bloom = BloomFilter()
+        return cls(document.get("keys", ()), bloom=bloom, legacy_last_seen=legacy_last_seen, key=key)
+
+    def save_to_file(self, feed_name):
+        with open(f"seen_{feed_name}.json", "w") as file:
+            json.dump(self.to_document(), file)
+        self.changed = False
+
+    @classmethod
+    def load_from_file(cls, feed_name, use_bloom=False, legacy_last_seen=None, key=entry_key):
+        try:
+            with open(f"seen_{feed_name}.json", "r") as file:
+                document = json.load(file)
+        except FileNotFoundError:
+            document = None
+        return cls.from_document(document, use_bloom, legacy_last_seen, key)
@@ -1,32 +1,11 @@
-import feedparser
 import json
-import time
-import requests
-from bs4 import BeautifulSoup
+from FeedCycle import fetch_new_entries, fetched, file_seen, file_validators, read_new_entries, run_script, save_file_state
+from SeenIndex import entry_key
+from Outbox import get_outbox
+from Extraction import fetch_previews
+from PreviewExtractor import RULE_IMG_AFTER_TITLE
 
-def save_last_seen_entry(feed_name, last_seen_entry_id):
-    with open(f"last_seen_{feed_name}.txt", "w") as file:
-        file.write(last_seen_entry_id)
-
-def load_last_seen_entry(feed_name):
-    try:
-        with open(f"last_seen_{feed_name}.txt", "r") as file:
-            return file.read().strip()
-    except FileNotFoundError:
-        return None
-
-def fetch_new_entries(url, last_seen_entry_id):
-    feed = feedparser.parse(url)
-    new_entries = []
-
-    for entry in feed.entries:
-        entry_id = entry.get("id", entry.link)  # Using link as a fallback identifier
-        if entry_id != last_seen_entry_id:
-            new_entries.append(entry)
-        else:
-            break
-
-    return new_entries
+NEWEST_FIRST = True  # blogs list posts newest first, so a poll stops at the ones posted
 
 def load_feed_info():
     try:
@@ -35,7 +14,7 @@ def load_feed_info():
     except FileNotFoundError:
         return []
     
-def send_discord_message(webhook_url, feed_name, feed_icon, color, tags, image, entry):
+def build_message(feed_name, feed_icon, color, tags, image, entry):
     try:
         title = entry.title
     except AttributeError:
@@ -65,57 +44,51 @@ def send_discord_message(webhook_url, feed_name, feed_icon, color, tags, image,
 
         ]
     }
-    headers = {"Content-Type": "application/json"}
-    response = requests.post(webhook_url, data=json.dumps(data), headers=headers)
-    if response.status_code == 204:
-        print("Message sent successfully")
-    else:
-        print(f"Failed to send message: {response.status_code}")
-
-def fetch_preview(url):
-    try:
-        response = requests.get(url)
-        response.raise_for_status() 
-        soup = BeautifulSoup(response.text, 'html.parser')
+    return data
 
-        title_tag = soup.find('title')
-        first_image_url = None
-        if title_tag:
-            first_image_tag = title_tag.find_next('img')
-            if first_image_tag and first_image_tag.get('src'):
-                first_image_url = first_image_tag['src']
-
-        if not first_image_url:
-            first_image_url = None
+def send_discord_message(webhook_url, feed_name, feed_icon, color, tags, image, entry):
+    get_outbox().enqueue(webhook_url, build_message(feed_name, feed_icon, color, tags, image, entry), entry_key(entry))
 
-        return first_image_url
-    except Exception as e:
-        return str(e)
+def fetch_preview(url):
+    # Prefers og:image, otherwise the first img after <title>
+    return fetch_previews([url], RULE_IMG_AFTER_TITLE)[0]
 
 
-feed_info = load_feed_info()
-for feed in feed_info:
+def process_feed(feed, result):
     feed_name = feed['name']
     feed_icon = feed['icon']
-    feed_url = feed['address']
     feed_color = feed['color']
     webhook = feed['webhook']
 
-    last_seen_entry_id = load_last_seen_entry(feed_name)
-    new_entries = fetch_new_entries(feed_url, last_seen_entry_id)
+    if not fetched(feed, result):
+        return 0
+
+    seen = load_seen(feed)
+    new_entries = read_new_entries(feed, result, seen)
+
+    # Cache misses are downloaded and parsed together, in the extraction pool for big batches
+    images = fetch_previews([entry.link for entry in new_entries], RULE_IMG_AFTER_TITLE)
+    for entry, image in zip(new_entries, images):
+        tags = ""
+        if entry.tags:
+            for tag in entry.tags:
+                tags += tag.term + ", "
+            tags = tags[:-2]
+        #print(f"Sending new entry: {entry.title}")
+        send_discord_message(webhook, feed_name, feed_icon, feed_color, tags, image, entry)
+
+    save_file_state(feed, result, seen, new_entries)
+    return len(new_entries)
+
+
+# The feed's seen state and validators live in files next to the script
+load_seen = file_seen
+feed_validators = file_validators
+
 
-    if new_entries:
-        last_entry_id = new_entries[0].get("id", new_entries[0].link)
-        save_last_seen_entry(feed_name, last_entry_id)
+def main():
+    run_script(__name__)
 
-        for entry in new_entries:
-            tags = ""
-            image = fetch_preview(entry.link)
-            if entry.tags:
-                for tag in entry.tags:
-                    tags += tag.term + ", "
-                tags = tags[:-2]
-            time.sleep(1)
-            #print(f"Sending new entry: {entry.title}")
-            send_discord_message(webhook, feed_name, feed_icon, feed_color, tags, image, entry)
 
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,26 @@
-import feedparser
+import copy
+import hashlib
 import json
-import time
 import re
-import requests
-from bs4 import BeautifulSoup
-from selenium.webdriver import Chrome
-from datetime import datetime
-
-def save_last_seen_entry(feed_name, last_seen_entry_id):
-    with open(f"last_seen_{feed_name}.txt", "w") as file:
-        file.write(last_seen_entry_id)
-
-def load_last_seen_entry(feed_name):
-    try:
-        with open(f"last_seen_{feed_name}.txt", "r") as file:
-            return file.read().strip()
-    except FileNotFoundError:
-        return None
-
-def fetch_new_entries(url, last_seen_entry_id):
-    feed = feedparser.parse(url)
-    new_entries = []
-
-    for entry in feed.entries:
-        entry_id = entry.get("id", entry.link)  # Using link as a fallback identifier
-        if entry_id != last_seen_entry_id:
-            new_entries.append(entry)
-        else:
-            break
-
-    return new_entries
+import time
+from datetime import datetime, timedelta
+from FeedCycle import fetch_new_entries, fetched, file_seen, file_validators, parse_entries, read_new_entries, run_script, save_file_state, save_file_validators
+from Metrics import NEW_ENTRIES, PARSE_SECONDS
+from Extraction import alert_fields, get_extraction_pool
+from MongoDBHandler import DEFAULT_URI, MongoDBHandler
+from PassIndex import PassIndex
+from PassReport import parse_pass_summary
+from SeenIndex import entry_key
+from Outbox import get_outbox
+from PreviewExtractor import RULE_CAMERA_DIV, fetch_preview_image
+
+ALERTS_FEED = "WSDoT Highway Alerts"
+RESOLVED_COLOR = 0x808080
+RESOLVED_RETAIN = timedelta(days=7)  # how long a cleared alert is remembered, should it come back
+# Both feeds are read to the end (see FeedCycle.feed_reader): alerts missing from the alerts feed have
+# cleared, and the pass feed lists the passes in a fixed order
+NEWEST_FIRST = False
+_ALERT_ID_RE = re.compile(r"/alert/(\d+)")
 
 def load_feed_info():
     try:
@@ -49,105 +40,81 @@ class HTMLContainer:
     pass
     
 def parse_html(html_string):
-    # Parse the HTML
-    soup = BeautifulSoup(html_string, 'html.parser')
+    return html_container(alert_fields(html_string))
 
-    # Find all div elements
-    divs = soup.find_all('div')
-
-    # Assigning each div to a specific field in HTMLContainer
+def html_container(fields):
+    # Assigning the first three divs' text to a specific field in HTMLContainer
     html = HTMLContainer()
-    html.impact = divs[0].get_text() if len(divs) > 0 else ""
-    html.desc = divs[1].get_text() if len(divs) > 1 else ""
-    html.date = divs[2].get_text() if len(divs) > 2 else ""
-
-    return html;
+    html.impact, html.desc, html.date = fields
+    return html
 
 def parse_html_passes(data_string):
-    name = re.search(r'<strong>(.*?)</strong>', data_string).group(1)
-    datetime_str = re.search(r'<strong>.*?</strong><br />(.*?)<br', data_string).group(1)
-    temperature = re.search(r'<strong>Temperature:</strong>&nbsp;(.*?)&deg;F', data_string).group(1)
-    directions = re.findall(r'<strong>(Eastbound|Westbound|Northbound|Southbound)</strong><br />(.*?)<br', data_string)
-    conditions = re.search(r'<strong>Conditions:</strong><br />(.*?)<br', data_string).group(1)
-    weather = re.search(r'<strong>Weather:</strong><br />(.*?)<br', data_string).group(1)
-
-    # Convert datetime string to datetime object
-    datetime_obj = datetime.strptime(datetime_str, '%m/%d/%Y %I:%M %p')
-
-    # Organizing data into a dictionary
-    extracted_data = {
-        "Name": name,
-        "Datetime": datetime_obj,
-        "Temperature": temperature + "°F",
-        "Directions": directions,
-        "Conditions": conditions,
-        "Weather": weather
-    }
-    return extracted_data
+    return parse_pass_summary(data_string)
     
-def send_discord_message_road(webhook_url, feed_name, feed_icon, color, tags, entry):
-
-
-    html = parse_html(entry.summary)
+def build_road_message(feed_name, feed_icon, color, tags, entry, html=None):
+    # Only high impact alerts are posted; others give None. html is the parsed summary, if already done
+    if html is None:
+        html = parse_html(entry.summary)
 
     if html.impact == "High Impact":
-        data = {
-            "username": feed_name,
-            "avatar_url": feed_icon,
-            "embeds": [
+        return road_message(feed_name, feed_icon, color, entry, html)
+    return None
+
+def road_message(feed_name, feed_icon, color, entry, html):
+    data = {
+        "username": feed_name,
+        "avatar_url": feed_icon,
+        "embeds": [
+            {
+            "title": entry.title,
+            "url": entry.link,
+            "description": html.desc,
+            "color": color,
+            "fields": [
                 {
-                "title": entry.title,
-                "url": entry.link,
-                "description": html.desc,
-                "color": color,
-                "fields": [
-                    {
-                        "name": "Impact",
-                        "value": html.impact
-                    }
-                ],
-                "image": {
-                    "url": ""
-                }
+                    "name": "Impact",
+                    "value": html.impact
                 }
+            ],
+            "image": {
+                "url": ""
+            }
+            }
 
-            ]
-        }
-    
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(webhook_url, data=json.dumps(data), headers=headers)
-        if response.status_code == 204:
-            print("Message sent successfully")
-        else:
-            print(f"Failed to send message: {response.status_code}")
+        ]
+    }
+    return data
+
+def build_resolved_message(data):
+    # The alert's last message, greyed out and marked as cleared
+    data = copy.deepcopy(data)
+    for embed in data["embeds"]:
+        embed["title"] = f"Resolved: {embed['title']}"
+        embed["color"] = RESOLVED_COLOR
+        embed["fields"] = [{"name": "Impact", "value": "Cleared"}]
+    return data
+
+def send_discord_message_road(webhook_url, feed_name, feed_icon, color, tags, entry, html=None):
+    data = build_road_message(feed_name, feed_icon, color, tags, entry, html)
+    if data is not None:
+        get_outbox().enqueue(webhook_url, data, entry_key(entry))
 
 def fetch_preview(url):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:104.0) Gecko/20100101 Firefox/104.0'
-        }
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Find the first <img> tag with class 'flat-camera-image'
-
-        camera_image_div = soup.find('div', class_='flat-camera-image')
-        img_tag = camera_image_div.find('img') if camera_image_div else None
-        image_url = img_tag['src'] if img_tag else None
-
-        return image_url
+        # The img inside the first div with class 'flat-camera-image'; meta images are skipped so we get the live camera frame
+        return fetch_preview_image(url, RULE_CAMERA_DIV, prefer_meta=False)
     except Exception as e:
         return str(e)
     
-def send_discord_message_passes(webhook_url, feed_name, feed_icon, color, tags, entry, waPass, summery):
+def build_pass_message(feed_name, feed_icon, color, tags, entry, waPass, summery):
     try:
         title = entry.title
     except AttributeError:
         title = feed_name
 
-    desc = f"{summery['Directions'][0][1]} \n {summery['Conditions']}"
+    direction = summery.directions[0][1] if summery.directions else ""
+    desc = f"{direction} \n {summery.conditions or ''}"
+    updated = summery.datetime.strftime('%m/%d/%Y %I:%M %p') if summery.datetime else "Unknown"
     formated_pic = f"{waPass['Camera']}?a={int(time.time())}"
     formated_username = f"WSDoT: {waPass['Pass']} - Elevation: {waPass['Elevation']}"
 
@@ -168,12 +135,12 @@ def send_discord_message_passes(webhook_url, feed_name, feed_icon, color, tags,
             "fields": [
                 {
                     "name": "Temperature",
-                    "value": summery['Temperature'],
+                    "value": summery.temperature or "Unknown",
                     "inline": True
                 },
                 {
                     "name": "Weather",
-                    "value": summery['Weather'],
+                    "value": summery.weather or "Unknown",
                     "inline": True
                 },
                 {
@@ -186,53 +153,175 @@ def send_discord_message_passes(webhook_url, feed_name, feed_icon, color, tags,
                 "url": formated_pic
             },
             "footer": {
-                "text": f"Last Updated{summery['Datetime'].strftime('%m/%d/%Y %I:%M %p')} PST",
+                "text": f"Last Updated{updated} PST",
             }
             }
 
         ]
     }
-    headers = {"Content-Type": "application/json"}
-    response = requests.post(webhook_url, data=json.dumps(data), headers=headers)
-    if response.status_code == 204:
-        print("Message sent successfully")
-    else:
-        print(f"Failed to send message: {response.status_code}")
+    return data
+
+def send_discord_message_passes(webhook_url, feed_name, feed_icon, color, tags, entry, waPass, summery):
+    data = build_pass_message(feed_name, feed_icon, color, tags, entry, waPass, summery)
+    get_outbox().enqueue(webhook_url, data, entry_key(entry))
 
 
 def find_partial_match(passes_list, title):
-    pass_name = title.split(' ')[0]
-    for pass_info in passes_list:
-        if pass_name in pass_info['Pass']:
-            return pass_info
-    return None 
+    # For one-off lookups; cycle_context builds one PassIndex per cycle and matches on that
+    return PassIndex(passes_list).match(title)
+
+
+def get_mongo_handler():
+    return MongoDBHandler(DEFAULT_URI, "WSDoTFeed")
+
+
+def alert_id(entry):
+    # The alert number in the link stays the same through an alert's revisions
+    match = _ALERT_ID_RE.search(entry.get("link", ""))
+    return match.group(1) if match else entry.get("id", entry.link)
 
-passes = load_pass_info()
 
-feed_info = load_feed_info()
-for feed in feed_info:
+def alert_revision(entry):
+    text = f"{entry.title}|{entry.get('link', '')}|{entry.summary}"
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def process_alerts(feed, entries):
+    # Every alert in the feed is compared with the revision last seen of it. A new High Impact alert
+    # is posted and its Discord message remembered; a revision of a posted alert edits that message,
+    # and a posted alert that has left the feed is edited to show it cleared. Returns how many alerts
+    # were new or revised, or None when the alert records couldn't be read.
+    feed_name, feed_icon, feed_color, webhook = feed['name'], feed['icon'], feed['color'], feed['webhook']
+    mongo_handler = get_mongo_handler()
+    tracked = mongo_handler.get_alerts(feed_name)
+    if tracked is None:
+        return None
+    outbox = get_outbox()
+    now = datetime.now()
+
+    current = {}
+    for entry in entries:
+        current.setdefault(alert_id(entry), entry)
+    seeded = []
+    if not tracked:
+        # First cycle after upgrading from per-entry seen state: alerts it shows as already posted are
+        # recorded without a message instead of being posted again
+        new_keys = {entry_key(entry) for entry in load_seen(feed).new_entries(entries)}
+        for id, entry in current.items():
+            if entry_key(entry) not in new_keys:
+                tracked[id] = {'revision': alert_revision(entry), 'status': 'open', 'message_key': None, 'updated_at': now}
+                seeded.append(id)
+    # A cleared alert that comes back counts as revised, so its message is reopened
+    changed = [(id, entry) for id, entry in current.items()
+               if tracked.get(id, {}).get('revision') != alert_revision(entry) or tracked[id].get('status') == 'resolved']
+    changed_ids = {id for id, _ in changed}
+    # During a storm a cycle can bring hundreds of revisions; their summaries are parsed as one batch
+    fields = get_extraction_pool().map(alert_fields, [(entry.summary,) for _, entry in changed])
+
+    with mongo_handler.unit_of_work() as uow:
+        for id in seeded:
+            uow.save_alert(feed_name, id, tracked[id])
+        for (id, entry), alert in zip(changed, fields):
+            record = tracked.get(id, {})
+            html = html_container(alert)
+            values = {'revision': alert_revision(entry), 'impact': html.impact, 'status': 'open', 'updated_at': now}
+            if record.get('message_key') is None:
+                data = build_road_message(feed_name, feed_icon, feed_color, "", entry, html)
+                if data is not None:
+                    key = entry_key(entry)
+                    outbox.enqueue(webhook, data, key, track=True)
+                    values.update({'message_key': key, 'message_id': None, 'payload': data})
+            else:
+                # Once posted, an alert keeps its message whatever its impact becomes. Revisions that
+                # only move the alert's timestamp leave the message as it is.
+                data = road_message(feed_name, feed_icon, feed_color, entry, html)
+                if data != record.get('payload') or record.get('status') == 'resolved':
+                    key = edit_key(record['message_key'], values['revision'])
+                    outbox.enqueue_edit(webhook, data, key, record['message_key'], alert_message_id(outbox, webhook, record))
+                    values.update({'message_key': key, 'payload': data})
+            uow.save_alert(feed_name, id, values)
+
+        # An empty or unreadable feed says nothing about which alerts have cleared
+        for id, record in tracked.items() if current else ():
+            if id in current:
+                if record.get('message_key') and id not in changed_ids:
+                    # Copied from the outbox, which forgets sent messages after a week
+                    message_id = outbox.message_id(webhook, record['message_key'])
+                    if message_id and message_id != record.get('message_id'):
+                        uow.save_alert(feed_name, id, {'message_id': message_id})
+            elif record.get('message_key') is None:
+                uow.delete_alert(feed_name, id)
+            elif record.get('status') != 'resolved':
+                data = build_resolved_message(record['payload'])
+                key = edit_key(record['message_key'], "resolved")
+                outbox.enqueue_edit(webhook, data, key, record['message_key'], alert_message_id(outbox, webhook, record))
+                uow.save_alert(feed_name, id, {'status': 'resolved', 'message_key': key, 'payload': data, 'updated_at': now})
+            elif now - record.get('updated_at', now) > RESOLVED_RETAIN:
+                uow.delete_alert(feed_name, id)
+    return len(changed)
+
+
+def edit_key(message_key, change):
+    # Outbox key of an edit, following on from the message_key it edits
+    return hashlib.blake2b(f"{message_key}|{change}".encode("utf-8"), digest_size=8).hexdigest()
+
+
+def alert_message_id(outbox, webhook, record):
+    return record.get('message_id') or outbox.message_id(webhook, record['message_key'])
+
+
+def process_feed(feed, result, pass_index=None):
     feed_name = feed['name']
     feed_icon = feed['icon']
     feed_url = feed['address']
     feed_color = feed['color']
     webhook = feed['webhook']
 
-    last_seen_entry_id = load_last_seen_entry(feed_name)
-    new_entries = fetch_new_entries(feed_url, last_seen_entry_id)
+    if not fetched(feed, result):
+        return 0
 
-    if new_entries:
-        last_entry_id = new_entries[0].get("id", new_entries[0].link)
-        save_last_seen_entry(feed_name, last_entry_id)
+    if feed_name == ALERTS_FEED:
+        # Alerts are followed through their revisions, so each cycle looks at the whole feed
+        with PARSE_SECONDS.time(feed=feed_name):
+            entries = parse_entries(feed_url, result.content, result.entries)
+        changed = process_alerts(feed, entries)
+        if changed is None:
+            print(f"Alert records unavailable, {feed_name} will be checked again next cycle")
+            return 0
+        NEW_ENTRIES.inc(changed, feed=feed_name)
+        save_file_validators(feed_name, result.etag, result.last_modified)
+        return changed
+
+    seen = load_seen(feed)
+    new_entries = read_new_entries(feed, result, seen)
+    if new_entries and pass_index is None:
+        pass_index = PassIndex(load_pass_info())
+
+    for entry in new_entries:
+        tags = ""
+        waPass = pass_index.match(entry.title)
+        if waPass is not None:
+            print(f"Sending new entry: {entry.title}")
+            summery = parse_html_passes(entry.summary)
+            send_discord_message_passes(webhook, feed_name, feed_icon, feed_color, tags, entry, waPass, summery)
+
+    save_file_state(feed, result, seen, new_entries)
+    return len(new_entries)
+
+
+# The feed's seen state and validators live in files next to the script
+load_seen = file_seen
+feed_validators = file_validators
+
+
+def cycle_context():
+    # WSDotPasses.json is read once a cycle, so the daemon picks up edits to it
+    return {"pass_index": PassIndex(load_pass_info())}
+
+
+def main():
+    run_script(__name__)
 
-        for entry in new_entries:
-            tags = ""
-            if feed_name == "WSDoT Highway Alerts":
-                send_discord_message_road(webhook, feed_name, feed_icon, feed_color, tags, entry)
-            else:
-                waPass = find_partial_match(passes, entry.title)
-                if waPass is not None:
-                    print(f"Sending new entry: {entry.title}")
-                    summery = parse_html_passes(entry.summary)
-                    send_discord_message_passes(webhook, feed_name, feed_icon, feed_color, tags, entry, waPass, summery)
-                
 
+if __name__ == "__main__":
+    main()
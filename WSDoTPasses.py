@@ -1,10 +1,17 @@
-import feedparser
 import json
-import time
-import re
-import requests
 from datetime import datetime, timedelta
-from MongoDBHandler import MongoDBHandler
+from MongoDBHandler import DEFAULT_URI, MongoDBHandler
+from FeedCycle import document_seen, document_validators, fetched, parse_entries, read_new_entries, run_script, save_document_state
+from FeedFetcher import FeedFetcher
+from Metrics import PASS_DECISIONS
+from PassChange import PassState, camera_url, camera_validators, pass_status
+from PassIndex import PassIndex
+from PassReport import parse_pass_summary
+from SeenIndex import entry_key
+from Outbox import get_outbox
+
+# Reports come in pass order, so a revised one can be anywhere: polls read the whole feed
+NEWEST_FIRST = False
 
 
 class FeedManager:
@@ -36,54 +43,40 @@ class FeedManager:
 
 class FeedParser:
     @staticmethod
-    def fetch_new_entries(url, last_seen_entry_id):
-        feed = feedparser.parse(url)
-        new_entries = []
-
-        for entry in feed.entries:
-            entry_id = entry.get("id", entry.link)  # Using link as a fallback identifier
-            if entry_id != last_seen_entry_id:
-                new_entries.append(entry)
-            else:
-                break
+    def fetch_new_entries(url, seen, content=None, entries=None):
+        return seen.new_entries(parse_entries(url, content, entries))
 
-        return new_entries
+    @staticmethod
+    def entry_key(entry):
+        # Pass reports keep their id between updates, so the updated stamp is part of the key
+        return entry_key(entry, include_updated=True)
 
 
 class PassParser:
     @staticmethod
     def parse_html_passes(data_string):
-        data = {
-            "Name": re.search(r'<strong>(.*?)</strong>', data_string).group(1),
-            "Datetime": datetime.strptime(re.search(r'<strong>.*?</strong><br />(.*?)<br', data_string).group(1), '%m/%d/%Y %I:%M %p'),
-            "Temperature": re.search(r'<strong>Temperature:</strong>&nbsp;(.*?)&deg;F', data_string).group(1) + "°F",
-            "Directions": re.findall(r'<strong>(Eastbound|Westbound|Northbound|Southbound)</strong><br />(.*?)<br', data_string),
-            "Conditions": re.search(r'<strong>Conditions:</strong><br />(.*?)<br', data_string).group(1),
-            "Weather": re.search(r'<strong>Weather:</strong><br />(.*?)<br', data_string).group(1)
-        }
-        return data
+        return parse_pass_summary(data_string)
 
     @staticmethod
     def find_partial_match(passes_list, title):
-        pass_name = title.split(' ')[0]
-        for pass_info in passes_list:
-            if pass_name in pass_info['Pass']:
-                return pass_info
-        return None
+        # For one-off lookups; a cycle should build one PassIndex and call match on it
+        return PassIndex(passes_list).match(title)
 
 
 class DiscordNotifier:
     @staticmethod
-    def send_discord_message_passes(webhook_url, feed_name, feed_icon, color, tags, entry, wa_pass, summary):
+    def build_message_passes(feed_name, feed_icon, color, tags, entry, wa_pass, summary, camera_version=None):
         try:
             title = entry.title
         except AttributeError:
             title = feed_name
 
-        desc = f"{summary['Directions'][0][1]} \n {summary['Conditions']}"
-        formatted_pic = f"{wa_pass['Camera']}?a={int(time.time())}"
+        direction = summary.directions[0][1] if summary.directions else ""
+        desc = f"{direction} \n {summary.conditions or ''}"
+        updated = summary.datetime.strftime('%m/%d/%Y %I:%M %p') if summary.datetime else "Unknown"
+        formatted_pic = camera_url(wa_pass['Camera'], camera_version)
         formatted_username = f"WSDoT: {wa_pass['Pass']} - Elevation: {wa_pass['Elevation']}"
-        status = "Closed" if 'closed' in entry.summary.lower() else "Open"
+        status = pass_status(entry)
 
         data = {
             "username": formatted_username,
@@ -94,58 +87,105 @@ class DiscordNotifier:
                 "description": desc,
                 "color": color,
                 "fields": [
-                    {"name": "Temperature", "value": summary['Temperature'], "inline": True},
-                    {"name": "Weather", "value": summary['Weather'], "inline": True},
+                    {"name": "Temperature", "value": summary.temperature or "Unknown", "inline": True},
+                    {"name": "Weather", "value": summary.weather or "Unknown", "inline": True},
                     {"name": "Status", "value": status, "inline": True}
                 ],
                 "image": {"url": formatted_pic},
-                "footer": {"text": f"Last Updated{summary['Datetime'].strftime('%m/%d/%Y %I:%M %p')} PST"}
+                "footer": {"text": f"Last Updated{updated} PST"}
             }]
         }
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(webhook_url, data=json.dumps(data), headers=headers)
-        if response.status_code == 204:
-            print("Message sent successfully")
-        else:
-            print(f"Failed to send message: {response.status_code}")
+        return data
+
+    @staticmethod
+    def send_discord_message_passes(webhook_url, feed_name, feed_icon, color, tags, entry, wa_pass, summary, camera_version=None):
+        data = DiscordNotifier.build_message_passes(feed_name, feed_icon, color, tags, entry, wa_pass, summary, camera_version)
+        get_outbox().enqueue(webhook_url, data, FeedParser.entry_key(entry))
+
+
+def get_mongo_handler():
+    return MongoDBHandler(DEFAULT_URI, "WSDotPasses")
+
+
+def load_feed_info():
+    return get_mongo_handler().get_feed_info()
+
+
+def load_seen(feed):
+    return document_seen(feed, key=FeedParser.entry_key)
+
+
+feed_validators = document_validators
+
+
+def unit_of_work():
+    return get_mongo_handler().unit_of_work()
+
+
+def cycle_context(uow):
+    return {"pass_index": PassIndex(uow.passes)}
+
+
+def is_due(wa_pass, now):
+    # Frequency is the shortest gap between two posts of a pass
+    last_posted_datetime = wa_pass['Last_Posted']
+    return not last_posted_datetime or now - last_posted_datetime >= timedelta(hours=wa_pass['Frequency'])
+
+
+def fetch_cameras(passes, fetcher=None):
+    # {camera url: FetchResult}, each a conditional GET against the validators of the last download
+    cameras = {wa_pass['Camera']: camera_validators(wa_pass) for wa_pass in passes if wa_pass.get('Camera')}
+    if not cameras:
+        return {}
+    return (fetcher or FeedFetcher()).fetch_all(list(cameras), cameras)
+
+
+def process_feed(feed, result, uow, pass_index):
+    feed_name, feed_icon, feed_color, webhook = feed['name'], feed['icon'], feed['color'], feed['webhook']
+
+    if result.not_modified:
+        print(f"No changes in {feed_name} since last fetch")
+    if not fetched(feed, result):
+        return 0
+    # Check if it's time to post again
+    #if last_posted_datetime and datetime.now() - last_posted_datetime < timedelta(hours=2)
+    seen = load_seen(feed)
+    new_entries = read_new_entries(feed, result, seen, FeedParser.fetch_new_entries)
+    matches = [(entry, pass_index.match(entry.title)) for entry in new_entries]
+    matches = [(entry, wa_pass) for entry, wa_pass in matches if wa_pass is not None]
+    now = datetime.now()
+    cameras = fetch_cameras([wa_pass for _, wa_pass in matches if is_due(wa_pass, now)])
+    for entry, wa_pass in matches:
+        tags = ""
+        if not is_due(wa_pass, now):
+            print(f"Skipping entry due to frequency constraints: {entry.title}")
+            continue
+        summary = PassParser.parse_html_passes(entry.summary)
+        state = PassState(wa_pass, summary, pass_status(entry), cameras.get(wa_pass.get('Camera')))
+        reason = state.reason(wa_pass, now)
+        PASS_DECISIONS.inc(decision=reason or "unchanged")
+        if reason is None:
+            print(f"Skipping unchanged pass report: {entry.title}")
+            updates = state.updates(wa_pass)
+            if updates:
+                uow.update_pass(wa_pass['_id'], updates)
+            continue
+        print(f"Sending new entry ({reason}): {entry.title}")
+        DiscordNotifier.send_discord_message_passes(webhook, feed_name, feed_icon, feed_color, tags, entry, wa_pass, summary,
+                                                    state.camera_version)
+        uow.update_pass(wa_pass['_id'], {'Last_Posted': now, **state.updates(wa_pass)})
+
+    save_document_state(uow, feed, result, seen, new_entries)
+    return len(new_entries)
 
 
 def main():
-    mongo_handler = MongoDBHandler("mongodb://localhost:27017", "WSDotPasses")
-    feed_parser = FeedParser()
-    pass_parser = PassParser()
-    notifier = DiscordNotifier()
+    mongo_handler = get_mongo_handler()
     mongo_handler.print_all_data()
-    
-    feeds = mongo_handler.get_feed_info()
-    print(feeds)
-    print(mongo_handler.test_connection())
-    
-
-    for feed in feeds:
-        id, feed_name, feed_icon, feed_url, feed_color, webhook = (feed['_id'],feed['name'], feed['icon'], feed['address'], feed['color'], feed['webhook'])
-
-        # Check if it's time to post again
-        #if last_posted_datetime and datetime.now() - last_posted_datetime < timedelta(hours=2)
-        last_seen_entry_id = None
-        new_entries = feed_parser.fetch_new_entries(feed_url, last_seen_entry_id)
-        for entry in new_entries:
-            tags = ""
-            passes = mongo_handler.get_passes()
-            wa_pass = pass_parser.find_partial_match(passes, entry.title)
-            if wa_pass is not None:
-                frequency_hours = wa_pass['Frequency']
-                last_posted_datetime = wa_pass['Last_Posted']
-                if last_posted_datetime and datetime.now() - last_posted_datetime < timedelta(hours=frequency_hours):
-                    print(f"Skipping entry due to frequency constraints: {entry.title}")
-                    continue
-                print(f"Sending new entry: {entry.title}")
-                summary = pass_parser.parse_html_passes(entry.summary)
-                notifier.send_discord_message_passes(webhook, feed_name, feed_icon, feed_color, tags, entry, wa_pass, summary)
-                current_datetime = datetime.now()
-                mongo_handler.update_last_posted_entry_datetime(wa_pass['_id'], current_datetime)
-
 
+    print(load_feed_info())
+    print(mongo_handler.test_connection())
+    run_script(__name__)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,258 @@
+"""Replays a storm of churning WSDoT highway alerts through WSDoTFeed and a fake Discord.
+
+    python benchmarks/bench_alert_edits.py
+    python benchmarks/bench_alert_edits.py --alerts 300 --cycles 40 --revise 0.3 --delete 0.02
+
+Each cycle serves a new snapshot of the alerts feed. Alerts appear, are revised (a new guid and
+text under the same /alert/<id> link, as WSDoT does), change impact and clear; --delete of the
+channel's messages are removed by hand, so the repost path is exercised too. With --drain-every N
+the outbox is only drained every N cycles, as when Discord is down or rate limiting, so revisions
+queue up and newer edits supersede older unsent ones. The fake webhook keeps
+every message, answers ?wait=true posts with the message and PATCHes to .../messages/<id> by editing
+it. Prints the webhook requests and channel messages it took, next to what posting every High Impact
+revision as a new message (the old behaviour) would have taken, and checks that the channel ends up
+showing each alert's latest revision, with cleared alerts marked resolved.
+MongoDB is mongomock, or $MONGO_URI with --mongod-uri.
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+from collections import Counter
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_load import _QuietServer, mongomock_client  # noqa: E402
+from MessageBatcher import MAX_EMBEDS  # noqa: E402
+
+FEED_NAME = "WSDoT Highway Alerts"
+IMPACTS = ("High Impact", "Moderate Impact", "Low Impact")
+
+
+class FakeWebhook:
+    def __init__(self, delete_share, seed):
+        self.lock = threading.Lock()
+        self.messages = {}           # message id -> payload currently shown
+        self.deleted = set()         # alerts whose message was deleted and not edited since
+        self.requests = Counter()    # POST, PATCH, and 404s
+        self.ids = itertools.count(1000)
+        self.delete_share = delete_share
+        self.random = random.Random(seed)
+        self.server = None
+
+    def serve(self):
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.answer(*webhook.post(self.path, self.body()))
+
+            def do_PATCH(self):
+                self.answer(*webhook.patch(self.path, self.body()))
+
+            def body(self):
+                return json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+            def answer(self, status, data):
+                body = json.dumps(data).encode("utf-8") if data is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _QuietServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/api/webhooks/1/token"
+
+    def post(self, path, data):
+        with self.lock:
+            self.requests["POST"] += 1
+            message_id = str(next(self.ids))
+            self.messages[message_id] = data
+            self.deleted.discard(alert_number(data))
+        wait = "wait=true" in urlsplit(path).query
+        return (200, {"id": message_id, **data}) if wait else (204, None)
+
+    def patch(self, path, data):
+        message_id = urlsplit(path).path.rsplit("/", 1)[-1]
+        with self.lock:
+            self.requests["PATCH"] += 1
+            if message_id not in self.messages:
+                self.requests["404"] += 1
+                return 404, {"message": "Unknown Message", "code": 10008}
+            self.messages[message_id] = data
+            self.deleted.discard(alert_number(data))
+        return 200, {"id": message_id, **data}
+
+    def moderate(self):
+        # A moderator deletes a few messages between cycles
+        with self.lock:
+            for message_id in list(self.messages):
+                if self.random.random() < self.delete_share:
+                    self.deleted.add(alert_number(self.messages.pop(message_id)))
+                    self.requests["deleted"] += 1
+
+
+def alert_number(data):
+    return data["embeds"][0]["title"].split()[-1]
+
+
+class Storm:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.alerts = {}       # alert number -> (revision, impact, text) while active
+        self.cleared = set()
+        self.numbers = itertools.count(710000)
+        self.legacy_posts = 0     # the old pipeline: one new message per High Impact revision (new guid)...
+        self.legacy_requests = 0  # ...packed up to 10 embeds to a webhook request
+        self.cycle_posts = 0
+
+    def step(self):
+        for number in list(self.alerts):
+            roll = self.random.random()
+            if roll < self.args.clear:
+                del self.alerts[number]
+                self.cleared.add(number)
+            elif roll < self.args.clear + self.args.revise:
+                revision, _, _ = self.alerts[number]
+                self.publish(number, revision + 1)
+        while len(self.alerts) < self.args.alerts:
+            self.publish(next(self.numbers), 0)
+        self.legacy_requests += -(-self.cycle_posts // MAX_EMBEDS)
+        self.cycle_posts = 0
+
+    def publish(self, number, revision):
+        # Most revisions update the text; now and then the impact changes too
+        impact = self.alerts[number][1] if number in self.alerts else None
+        if impact is None or self.random.random() < self.args.impact_change:
+            impact = self.random.choices(IMPACTS, weights=(3, 4, 3))[0]
+        text = f"Revision {revision}: crews on scene near milepost {self.random.randint(1, 300)}."
+        self.alerts[number] = (revision, impact, text)
+        self.cleared.discard(number)
+        if impact == "High Impact":
+            self.legacy_posts += 1
+            self.cycle_posts += 1
+
+    def rss(self):
+        items = []
+        for number, (revision, impact, text) in sorted(self.alerts.items(), reverse=True):
+            summary = f"&lt;div&gt;{impact}&lt;/div&gt;&lt;div&gt;{text}&lt;/div&gt;&lt;div&gt;10/18/2024 04:00 PM&lt;/div&gt;"
+            items.append(f"<item><title>Alert {number}</title><link>https://wsdot.com/travel/real-time/alert/{number}</link>"
+                         f"<description>{summary}</description><guid isPermaLink=\"false\">{number}-{revision}</guid>"
+                         f"<pubDate>{formatdate(usegmt=True)}</pubDate></item>")
+        return ("<?xml version=\"1.0\" encoding=\"utf-8\"?><rss version=\"2.0\"><channel><title>WSDOT Highway Alerts</title>"
+                f"<link>https://wsdot.com/travel/real-time/alerts</link>{''.join(items)}</channel></rss>").encode("utf-8")
+
+
+def check(storm, webhook, records):
+    # Every alert that was ever High Impact should have exactly one message showing its latest state
+    problems = []
+    shown = {}
+    for message_id, data in webhook.messages.items():
+        title = data["embeds"][0]["title"]
+        shown.setdefault(alert_number(data), []).append((message_id, title, data))
+    for number, messages in shown.items():
+        if len(messages) > 1:
+            problems.append(f"alert {number} has {len(messages)} messages")
+    for alert_id, record in records.items():
+        if not record.get("message_key"):
+            continue
+        messages = shown.get(alert_id)
+        if not messages:
+            if alert_id not in webhook.deleted:
+                problems.append(f"alert {alert_id} has no message")
+            continue
+        _, title, data = messages[0]
+        if int(alert_id) in storm.alerts:
+            _, impact, text = storm.alerts[int(alert_id)]
+            if title.startswith("Resolved") or data["embeds"][0]["description"] != text:
+                problems.append(f"alert {alert_id} shows {title!r}: {data['embeds'][0]['description']!r}, not {text!r}")
+        elif not title.startswith("Resolved"):
+            problems.append(f"cleared alert {alert_id} is not marked resolved")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--alerts", type=int, default=120, help="alerts active at any time")
+    parser.add_argument("--cycles", type=int, default=30)
+    parser.add_argument("--revise", type=float, default=0.25, help="share of alerts revised each cycle")
+    parser.add_argument("--impact-change", type=float, default=0.15, help="share of revisions that change the impact")
+    parser.add_argument("--clear", type=float, default=0.05, help="share of alerts cleared each cycle")
+    parser.add_argument("--delete", type=float, default=0.01, help="share of channel messages deleted each cycle")
+    parser.add_argument("--drain-every", type=int, default=1, help="cycles between outbox drains")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mongod-uri", action="store_true", help="use the MongoDB at $MONGO_URI instead of mongomock")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench_alert_edits_")
+    # The outbox and validator files live in the working directory
+    os.chdir(workdir)
+    from MongoDBHandler import DEFAULT_URI, MongoDBHandler
+    if not args.mongod_uri:
+        MongoDBHandler.use_client(DEFAULT_URI, mongomock_client())
+    import WSDoTFeed
+    from FeedFetcher import FetchResult
+    from Outbox import Outbox
+
+    webhook = FakeWebhook(args.delete, args.seed + 1)
+    webhook.serve()
+    feed = {"name": FEED_NAME, "icon": "https://example.com/icon.png", "address": "https://wsdot.example/alerts.xml",
+            "color": 0xff9900, "webhook": webhook.url}
+    outbox = Outbox(os.path.join(workdir, "outbox.sqlite"), batch_window=0)
+    WSDoTFeed.get_outbox = lambda: outbox
+    storm = Storm(args)
+
+    log_path = os.path.join(workdir, "scripts.log")
+    with open(log_path, "w") as log, contextlib.redirect_stdout(log):
+        for cycle in range(1, args.cycles + 1):
+            storm.step()
+            WSDoTFeed.process_feed(feed, FetchResult(feed["address"], 200, storm.rss()))
+            if cycle % args.drain_every == 0:
+                outbox.flush()
+            webhook.moderate()
+        outbox.close()
+    records = WSDoTFeed.get_mongo_handler().get_alerts(FEED_NAME)
+    superseded = outbox._db.execute("SELECT COUNT(*) FROM messages WHERE superseded_by IS NOT NULL").fetchone()[0]
+
+    requests = webhook.requests["POST"] + webhook.requests["PATCH"]
+    print(f"{args.alerts} alerts over {args.cycles} cycles, {args.revise:.0%} revised and {args.clear:.0%} cleared per cycle, "
+          f"drained every {args.drain_every}")
+    print(f"{'':28} {'webhook requests':>17} {'channel messages':>17}")
+    print(f"{'new message per revision':28} {storm.legacy_requests:>17} {storm.legacy_posts:>17}")
+    print(f"{'edited in place':28} {requests:>17} {webhook.requests['POST']:>17}")
+    print(f"edits {webhook.requests['PATCH']}, of which {webhook.requests['404']} found their message deleted "
+          f"({webhook.requests['deleted']} deleted) and were reposted; {superseded} queued updates superseded before sending")
+    print(f"scripts' output: {log_path}")
+
+    problems = check(storm, webhook, records)
+    for problem in problems[:20]:
+        print(f"  {problem}")
+    if problems:
+        raise SystemExit(f"{len(problems)} alerts are shown wrongly")
+    print("channel matches the feed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Per-poll cost of finding new entries: feedparser over the whole feed vs the streaming reader.
+
+Each feed in benchmarks/fixtures is polled with all but its newest two entries already seen, the
+usual case. The feeds are synthetic: each follows its site's format (RSS 2.0 or Atom, namespaces,
+content markup) but holds generated placeholder text, not a capture of the live feed. A 400-entry
+Tumblr archive built from the Tumblr fixture shows how the gap grows with feed length. First it
+checks that a pass report revised in the middle of the pass feed is still found by the reader the
+pass scripts poll with, since that feed isn't newest first. Runs offline:
+
+    python benchmarks/bench_feed_parse.py
+"""
+import os
+import re
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import feedparser  # noqa: E402
+import FeedCycle  # noqa: E402
+import WSDoTPasses  # noqa: E402
+from FeedStream import read_feed  # noqa: E402
+from SeenIndex import SeenIndex  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FEEDS = ("npr.xml", "ars.xml", "verge.xml", "tumblr.xml", "wsdot_alerts.xml", "wsdot_passes.xml")
+CHUNK_SIZE = 16 * 1024
+NEW_ENTRIES = 2
+
+
+def chunked(data):
+    return (data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE))
+
+
+def tumblr_archive(size=400):
+    data = open(os.path.join(FIXTURES, "tumblr.xml"), "rb").read().decode("utf-8")
+    head, rest = data.split("<item>", 1)
+    items = re.findall(r"<item>.*?</item>", "<item>" + rest, re.S)
+    archive = []
+    for number in range(size):
+        item = items[number % len(items)]
+        archive.append(re.sub(r"/post/(\d+)", lambda match: f"/post/{int(match.group(1)) - number}", item))
+    return (head + "\n".join(archive) + "\n</channel></rss>\n").encode("utf-8")
+
+
+def seen_for(data):
+    seen = SeenIndex()
+    seen.mark_seen(feedparser.parse(data).entries[NEW_ENTRIES:])
+    return seen
+
+
+def poll_feedparser(data, seen):
+    return seen.new_entries(feedparser.parse(data).entries)
+
+
+def poll_stream(data, seen):
+    return seen.new_entries(read_feed(chunked(data), seen).entries)
+
+
+def revise_pass(data, position=4):
+    # A new report for the fifth pass (Wauconda): same guid, later pubDate, new weather
+    text = data.decode("utf-8")
+    item = re.findall(r"<item>.*?</item>", text, re.S)[position]
+    revised = re.sub(r"<pubDate>.*?</pubDate>", "<pubDate>Sat, 19 Oct 2024 06:30:00 +0000</pubDate>", item)
+    revised = revised.replace("Overcast", "Heavy snow")
+    return text.replace(item, revised).encode("utf-8"), re.search(r"<title>(.*?)</title>", item).group(1)
+
+
+def check_revised_pass():
+    # The pass feed lists passes in a fixed order, so the reader WSDoTPasses polls with has to get past
+    # the reports already posted to find one revised since
+    data = open(os.path.join(FIXTURES, "wsdot_passes.xml"), "rb").read()
+    revised, title = revise_pass(data)
+    seen = WSDoTPasses.load_seen({})
+    seen.mark_seen(feedparser.parse(data).entries)
+    feed = {'name': "passes", 'address': "", 'seen': seen.to_document()}
+    entries = FeedCycle.feed_reader(WSDoTPasses, feed)(chunked(revised)).entries
+    found = [entry.title for entry in WSDoTPasses.load_seen(feed).new_entries(entries)]
+    if found != [title]:
+        raise SystemExit(f"revised report for {title} not found, got {found}")
+    print(f"revised mid-feed pass report ({title}) found")
+
+
+def peak_bytes(function, *args):
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    check_revised_pass()
+    feeds = [(name, open(os.path.join(FIXTURES, name), "rb").read()) for name in FEEDS]
+    feeds.append(("tumblr archive (400)", tumblr_archive()))
+
+    print(f"{'feed':22} {'size':>8} {'feedparser':>12} {'stream':>12} {'speedup':>8} {'peak memory':>22}")
+    for name, data in feeds:
+        seen = seen_for(data)
+        expected = poll_feedparser(data, seen)
+        actual = poll_stream(data, seen)
+        if [entry.get("id", entry.link) for entry in expected] != [entry.get("id", entry.link) for entry in actual]:
+            raise SystemExit(f"{name}: streaming reader found different new entries")
+
+        number = 20
+        legacy_time = min(timeit.repeat(lambda: poll_feedparser(data, seen), number=number, repeat=3)) / number
+        stream_time = min(timeit.repeat(lambda: poll_stream(data, seen), number=number, repeat=3)) / number
+        legacy_peak = peak_bytes(poll_feedparser, data, seen)
+        stream_peak = peak_bytes(poll_stream, data, seen)
+        print(f"{name:22} {len(data) // 1024:>6}KB {legacy_time * 1000:>10.2f}ms {stream_time * 1000:>10.2f}ms "
+              f"{legacy_time / stream_time:>7.1f}x {legacy_peak // 1024:>9}KB -> {stream_peak // 1024}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Conformance and speed of the HtmlBackend parsers (selectolax, lxml, BeautifulSoup).
+
+First checks that every installed backend, and the pre-HtmlBackend BeautifulSoup code, give identical
+results on the Verge entry contents and WSDoT alert summaries of the synthetic feed fixtures, the
+offline replica article pages and a few hand-written edge cases; any difference is printed and the
+script exits 1. Then times each backend on the same inputs. Offline:
+
+    python benchmarks/bench_html_backend.py
+"""
+import glob
+import os
+import sys
+import timeit
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import feedparser  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+from HtmlBackend import available_backends, parse  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(BENCH_DIR, "fixtures")
+
+# Hand-written edge cases: entities, nesting, comments, script/style/template text, missing tags,
+# a comment-only body and an XML declaration (bs4 warns on that one; main silences it)
+EDGE_CASES = [
+    "",
+    "<p>no image here</p>",
+    "<img><p>a &amp; <b>b</b></p>",
+    "<p>before</p><img src='x.png'><div><p>nested <i>p</i></p></div>",
+    "<div>x<div>y</div>z</div><div>w</div>",
+    "<!-- c --><div><!--c-->t<script>s()</script></div>",
+    "<div>a<style>x{}</style>b<template><p>t</p></template>c</div>",
+    "<title>t</title><p>x</p><img src=\"after-title.jpg\">",
+    "<!-- embed removed -->",
+    "<?xml version=\"1.0\" encoding=\"utf-8\"?><div>caf\u00e9</div><img src=\"x.png\"><p>na\u00efve</p>",
+]
+
+
+# The pre-HtmlBackend extraction code, kept verbatim as the reference
+def legacy_verge(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    img_tag = soup.find('img')
+    image_url = img_tag['src'] if img_tag else None
+    p_tag = img_tag.find_next('p') if img_tag else None
+    summary = p_tag.get_text() if p_tag else ''
+    return image_url, summary
+
+
+def legacy_alert(html_string):
+    soup = BeautifulSoup(html_string, 'html.parser')
+    divs = soup.find_all('div')
+    return (divs[0].get_text() if len(divs) > 0 else "", divs[1].get_text() if len(divs) > 1 else "",
+            divs[2].get_text() if len(divs) > 2 else "")
+
+
+def verge_ops(document):
+    return document.first_img_src(), document.first_p_text_after_img() or ''
+
+
+def alert_ops(document):
+    texts = document.div_texts(3)
+    return tuple(texts + [""] * (3 - len(texts)))
+
+
+def page_ops(document):
+    return document.first_img_src(after="title"), document.first_p_text_after_img(), document.div_texts(3)
+
+
+def load_inputs():
+    verge = [entry.content[0].value for entry in feedparser.parse(os.path.join(FIXTURES, "verge.xml")).entries]
+    alerts = [entry.summary for entry in feedparser.parse(os.path.join(FIXTURES, "wsdot_alerts.xml")).entries]
+    pages = []
+    for path in sorted(glob.glob(os.path.join(BENCH_DIR, "pages", "*.html"))):
+        with open(path, encoding="utf-8") as file:
+            pages.append(file.read())
+    return [
+        ("verge content", verge, verge_ops, legacy_verge),
+        ("alert summaries", alerts, alert_ops, legacy_alert),
+        ("article pages", pages, page_ops, None),
+        ("edge cases", EDGE_CASES, page_ops, None),
+    ]
+
+
+def check(workloads, backends):
+    mismatches = 0
+    for name, inputs, ops, legacy in workloads:
+        for html in inputs:
+            results = {backend: ops(parse(html, backend)) for backend in backends}
+            if legacy is not None:
+                results["legacy"] = legacy(html)
+            if len(set(map(repr, results.values()))) > 1:
+                mismatches += 1
+                print(f"{name}: backends disagree on {html[:80]!r}")
+                for backend, result in results.items():
+                    print(f"    {backend:10} {result!r:.200}")
+    return mismatches
+
+
+def main():
+    warnings.filterwarnings("ignore", message="It looks like you're using an HTML parser to parse an XML document")
+    backends = available_backends()
+    if "bs4" not in backends:
+        raise SystemExit("BeautifulSoup is needed as the reference backend")
+    workloads = load_inputs()
+
+    mismatches = check(workloads, backends)
+    total = sum(len(inputs) for _, inputs, _, _ in workloads)
+    if mismatches:
+        raise SystemExit(f"{mismatches} of {total} inputs differ between backends")
+    print(f"conformance: {', '.join(backends)} agree on all {total} inputs\n")
+
+    print(f"{'workload':18} {'inputs':>6} " + " ".join(f"{backend + ' ms':>14}" for backend in backends) + "  speedup vs bs4")
+    for name, inputs, ops, _ in workloads[:3]:
+        times = {}
+        for backend in backends:
+            def run():
+                for html in inputs:
+                    ops(parse(html, backend))
+            number = 3 if name == "article pages" else 20
+            times[backend] = min(timeit.repeat(run, number=number, repeat=3)) / number
+        speedups = ", ".join(f"{backend} {times['bs4'] / times[backend]:.1f}x" for backend in backends if backend != "bs4")
+        print(f"{name:18} {len(inputs):>6} " + " ".join(f"{times[backend] * 1000:>14.2f}" for backend in backends)
+              + f"  {speedups}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,475 @@
+"""End-to-end load test: the real FeedDaemon against local fake feed sites and a fake Discord.
+
+    python benchmarks/bench_load.py                               # 60 feeds for 60s
+    python benchmarks/bench_load.py --feeds 500 --publish-interval 5 --webhook-429 0.05
+    python benchmarks/bench_load.py --slowloris 0.05 --json load.json
+
+Starts, all on loopback:
+- fake feed sites on --hosts addresses (127.0.0.1, 127.0.0.2, ...) serving synthetic RSS whose
+  entries are published on a Poisson schedule, with ETag 304s, --feed-latency and a --slowloris
+  share of responses dribbled out a few bytes at a time, plus small article pages for previews
+- a fake Discord webhook endpoint that enforces a per-webhook 5 per 2s limit like Discord, and
+  also answers --webhook-429 of posts with 429 + retry_after and --webhook-5xx with 502
+- MongoDB: mongomock in-process, or a throwaway mongod with --mongod
+
+Feeds are spread over the Mongo-backed sources (npr, ars, verge), each with --subscriptions
+configs that post to different webhooks (spelling the feed's address differently, and in different
+sources), and polled by an in-process FeedDaemon for --duration seconds, then for --settle more with publishing stopped, after which
+the outbox is drained for up to --drain seconds. Reports throughput, entry-to-post latency (from
+an entry's publish time to its embed reaching the webhook), dropped posts (published but never
+accepted by the webhook) and duplicate posts. Scripts' output goes to a log in the temp directory.
+"""
+import argparse
+import bisect
+import contextlib
+import importlib
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Sources configured through Mongo -> script module
+SOURCES = {"npr": "NPRFeed", "ars": "ArsTechnicaFeed", "verge": "TheVergeFeed"}
+WINDOW = 30                         # entries a feed shows, newest first
+WEBHOOK_LIMIT = 5                   # Discord's per-webhook bucket: 5 posts...
+WEBHOOK_WINDOW = 2.0                # ...per 2 seconds
+SLOWLORIS_PIECE = 64                # bytes per dribbled write
+_ARTICLE_RE = re.compile(r"/article/(\d+)/(-?\d+)")
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.webhook_statuses = Counter()
+        self.received = {}       # (feed, entry, webhook) -> first time the webhook accepted it
+        self.deliveries = Counter()
+        self.embeds_per_post = []
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+
+class FeedSite:
+    # Synthetic feeds: feed i publishes entries 0, 1, 2, ... at the precomputed schedule[i] offsets
+    # from start; negative entry numbers are the backlog already there when the run begins
+    def __init__(self, args, stats):
+        self.args = args
+        self.stats = stats
+        self.start = None
+        self.wall_start = None
+        self.publishing_until = args.duration
+        self.random = random.Random(args.seed)
+        self.random_lock = threading.Lock()
+        self.schedule = []
+        for feed in range(args.feeds):
+            feed_random = random.Random(args.seed * 100003 + feed)
+            times, offset = [], 0.0
+            while True:
+                offset += feed_random.expovariate(1 / args.publish_interval)
+                if offset >= args.duration:
+                    break
+                times.append(offset)
+            self.schedule.append(times)
+        self.servers = []
+
+    def chance(self, probability):
+        with self.random_lock:
+            return self.random.random() < probability
+
+    def published(self, feed):
+        # How many scheduled entries of feed are out by now
+        if self.start is None:
+            return 0
+        elapsed = min(time.monotonic() - self.start, self.publishing_until)
+        return bisect.bisect_right(self.schedule[feed], elapsed)
+
+    def url(self, feed, path):
+        host, port = self.servers[feed % len(self.servers)].server_address
+        return f"http://{host}:{port}{path}"
+
+    def link(self, feed, number):
+        return self.url(feed, f"/article/{feed}/{number}")
+
+    def published_at(self, feed, number):
+        offset = self.schedule[feed][number] if number >= 0 else number * self.args.publish_interval
+        return formatdate(self.wall_start + offset, usegmt=True)
+
+    def rss(self, feed, count):
+        items = []
+        for number in range(count - 1, max(-self.args.initial_entries, count - WINDOW) - 1, -1):
+            link = self.link(feed, number)
+            items.append(f"<item><title>Feed {feed} entry {number}</title><link>{link}</link>"
+                         f"<guid isPermaLink=\"true\">{link}</guid>"
+                         f"<description>Summary of entry {number} on feed {feed}.</description>"
+                         f"<content:encoded><![CDATA[<p><img src=\"{link}.jpg\"/></p><p>Lead paragraph {number}.</p>]]>"
+                         f"</content:encoded><category>load</category><category>feed {feed}</category>"
+                         f"<pubDate>{self.published_at(feed, number)}</pubDate></item>")
+        return ("<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
+                "<rss version=\"2.0\" xmlns:content=\"http://purl.org/rss/1.0/modules/content/\"><channel>"
+                f"<title>Load feed {feed}</title><link>{self.url(feed, '/')}</link><description>synthetic</description>"
+                + "".join(items) + "</channel></rss>").encode("utf-8")
+
+    def serve(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                time.sleep(site.args.feed_latency / 1000)
+                match = _ARTICLE_RE.fullmatch(self.path)
+                if match:
+                    site.stats.count("article_requests")
+                    body = (f"<html><head><title>Entry {match.group(2)}</title><meta property=\"og:image\" "
+                            f"content=\"{self.path}.jpg\"></head><body><p>Article</p></body></html>").encode("utf-8")
+                    self.respond(200, body)
+                    return
+                if not self.path.startswith("/feed/"):
+                    self.send_error(404)
+                    return
+
+                feed = int(self.path.rsplit("/", 1)[1])
+                count = site.published(feed)
+                etag = f'"{feed}-{count}"'
+                site.stats.count("feed_requests")
+                if self.headers.get("If-None-Match") == etag:
+                    site.stats.count("feed_304")
+                    self.respond(304, b"", {"ETag": etag})
+                    return
+                body = site.rss(feed, count)
+                if site.chance(site.args.slowloris):
+                    site.stats.count("feed_slowloris")
+                    self.respond(200, body, {"ETag": etag, "Content-Type": "application/rss+xml"}, slow=True)
+                else:
+                    self.respond(200, body, {"ETag": etag, "Content-Type": "application/rss+xml"})
+
+            def respond(self, status, body, headers=None, slow=False):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                if status != 304:
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if not slow:
+                    self.wfile.write(body)
+                    return
+                # Each write arrives well inside the client's read timeout, so only a total deadline stops it
+                for offset in range(0, len(body), SLOWLORIS_PIECE):
+                    self.wfile.write(body[offset:offset + SLOWLORIS_PIECE])
+                    self.wfile.flush()
+                    time.sleep(site.args.slowloris_delay)
+
+            def log_message(self, *args):
+                pass
+
+        for host in range(1, self.args.hosts + 1):
+            server = _QuietServer((f"127.0.0.{host}", 0), Handler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+
+
+class FakeDiscord:
+    def __init__(self, args, stats):
+        self.args = args
+        self.stats = stats
+        self.buckets = {}
+        self.random = random.Random(args.seed + 1)  # only used under stats.lock
+        self.server = None
+
+    def serve(self):
+        discord = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                time.sleep(discord.args.webhook_latency / 1000)
+                webhook = self.path.split("/")[3]
+                status, headers, body = discord.answer(webhook, data)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _QuietServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def webhook_url(self, number):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/api/webhooks/{number}/token-{number}"
+
+    def answer(self, webhook, data):
+        now = time.monotonic()
+        with self.stats.lock:
+            window_start, used = self.buckets.get(webhook, (now, 0))
+            if now - window_start >= WEBHOOK_WINDOW:
+                window_start, used = now, 0
+            reset_after = WEBHOOK_WINDOW - (now - window_start)
+            if used >= WEBHOOK_LIMIT:
+                status = 429
+            elif self.random.random() < self.args.webhook_429:
+                status, reset_after = 429, self.random.uniform(0.2, 2.0)
+            elif self.random.random() < self.args.webhook_5xx:
+                status = 502
+            else:
+                status, used = 204, used + 1
+                self.embeds_accepted(webhook, data, now)
+            self.buckets[webhook] = (window_start, used)
+            self.stats.webhook_statuses[status] += 1
+
+        headers = {"X-RateLimit-Limit": str(WEBHOOK_LIMIT), "X-RateLimit-Remaining": str(max(0, WEBHOOK_LIMIT - used)),
+                   "X-RateLimit-Reset-After": f"{reset_after:.3f}"}
+        if status == 429:
+            headers["Content-Type"] = "application/json"
+            return status, headers, json.dumps({"message": "You are being rate limited.", "retry_after": round(reset_after, 3),
+                                                "global": False}).encode("utf-8")
+        return status, headers, b""
+
+    def embeds_accepted(self, webhook, data, now):
+        embeds = data.get("embeds") or []
+        self.stats.embeds_per_post.append(len(embeds))
+        for embed in embeds:
+            match = _ARTICLE_RE.search(embed.get("url") or "")
+            if match:
+                key = (int(match.group(1)), int(match.group(2)), int(webhook))
+                self.stats.deliveries[key] += 1
+                self.stats.received.setdefault(key, now)
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients hanging up mid-response (stream readers, shutdown) are expected here
+
+
+def start_mongod(workdir):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    dbpath = os.path.join(workdir, "mongod")
+    os.makedirs(dbpath)
+    process = subprocess.Popen(["mongod", "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=1):
+            return process, f"mongodb://127.0.0.1:{port}"
+        time.sleep(0.2)
+    process.kill()
+    raise SystemExit("mongod did not start")
+
+
+def mongomock_client():
+    import mongomock
+    from mongomock.collection import BulkOperationBuilder
+
+    # pymongo 4.9+ passes sort= to add_update from bulk_write's UpdateOne, which mongomock 4.3
+    # doesn't know about; the unit of work never sets a sort, so it is safe to drop
+    add_update = BulkOperationBuilder.add_update
+    if "sort" not in add_update.__code__.co_varnames:
+        def add_update_without_sort(self, *args, sort=None, **kwargs):
+            return add_update(self, *args, **kwargs)
+        BulkOperationBuilder.add_update = add_update_without_sort
+    return mongomock.MongoClient()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def seed_feeds(args, site, discord, MongoDBHandler, uri):
+    from FeedStream import FeedEntry
+    from SeenIndex import SeenIndex, entry_key
+
+    for feed, subscription in itertools.product(range(args.feeds), range(args.subscriptions)):
+        source = args.sources[(feed + subscription) % len(args.sources)]
+        module = importlib.import_module(SOURCES[source])
+        address = site.url(feed, f"/feed/{feed}")
+        if subscription:
+            # The same feed written another way, as a second config often is
+            address = f"{'HTTP' if subscription % 2 else 'http'}{address[4:]}#{subscription}"
+        document = {"name": f"load-{feed}" + (f"-{subscription}" if subscription else ""), "icon": "https://example.com/icon.png",
+                    "color": 0x336699, "address": address, "webhook": discord.webhook_url(subscription_webhook(args, feed, subscription))}
+        if not args.cold_start:
+            # Steady state: the backlog was posted by an earlier run
+            backlog = [FeedEntry(id=site.link(feed, number), link=site.link(feed, number))
+                       for number in range(-args.initial_entries, 0)]
+            document["seen"] = SeenIndex([entry_key(entry) for entry in backlog]).to_document()
+        MongoDBHandler(uri, "NewsFeeds", module.collection_name).feeds.insert_one(document)
+
+
+def subscription_webhook(args, feed, subscription):
+    return (feed + subscription) % args.webhooks
+
+
+def report(args, site, stats, started, elapsed):
+    expected = {}
+    for feed, times in enumerate(site.schedule):
+        for subscription in range(args.subscriptions):
+            webhook = subscription_webhook(args, feed, subscription)
+            for number, offset in enumerate(times):
+                expected[(feed, number, webhook)] = offset
+            if args.cold_start:
+                for number in range(-args.initial_entries, 0):
+                    expected[(feed, number, webhook)] = 0.0
+
+    latencies = [stats.received[key] - started - offset for key, offset in expected.items() if key in stats.received]
+    delivered = [stats.received[key] for key in expected if key in stats.received]
+    result = {
+        "feeds": args.feeds,
+        "subscriptions": args.subscriptions,
+        "sources": args.sources,
+        "duration": args.duration,
+        "elapsed": round(elapsed, 1),
+        "published": len(expected),
+        "posted": len(latencies),
+        "dropped": len(expected) - len(latencies),
+        "duplicates": sum(count - 1 for count in stats.deliveries.values() if count > 1),
+        "unexpected": len(set(stats.deliveries) - set(expected)),
+        "throughput_per_sec": round(len(delivered) / max(1e-9, max(delivered) - started), 2) if delivered else 0.0,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p90": percentile(latencies, 0.90),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": max(latencies) if latencies else None,
+        "feed_requests": stats.counts["feed_requests"],
+        "feed_304": stats.counts["feed_304"],
+        "feed_slowloris": stats.counts["feed_slowloris"],
+        "article_requests": stats.counts["article_requests"],
+        "webhook_statuses": {str(status): count for status, count in sorted(stats.webhook_statuses.items())},
+        "embeds_per_post": round(sum(stats.embeds_per_post) / len(stats.embeds_per_post), 2) if stats.embeds_per_post else None,
+    }
+
+    print(f"feeds {result['feeds']} x {result['subscriptions']} subscriptions ({', '.join(args.sources)}) for {args.duration:.0f}s, finished after {result['elapsed']}s")
+    print(f"published {result['published']}, posted {result['posted']}, dropped {result['dropped']}, "
+          f"duplicates {result['duplicates']}, unexpected {result['unexpected']}")
+    print(f"throughput {result['throughput_per_sec']} posts/s, {result['embeds_per_post']} embeds per webhook post")
+    if latencies:
+        print(f"entry-to-post latency p50 {result['latency_p50']:.2f}s  p90 {result['latency_p90']:.2f}s  "
+              f"p99 {result['latency_p99']:.2f}s  max {result['latency_max']:.2f}s")
+    print(f"feed requests {result['feed_requests']} ({result['feed_304']} 304, {result['feed_slowloris']} slowloris), "
+          f"article requests {result['article_requests']}")
+    print(f"webhook responses {result['webhook_statuses']}")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--feeds", type=int, default=60)
+    parser.add_argument("--subscriptions", type=int, default=1, help="configs per feed, each posting to its own webhook")
+    parser.add_argument("--sources", default=",".join(SOURCES), help="comma separated subset of npr,ars,verge")
+    parser.add_argument("--duration", type=float, default=60, help="seconds entries keep being published")
+    parser.add_argument("--settle", type=float, default=None, help="seconds polling continues after publishing stops "
+                                                                   "(default: max interval + 10)")
+    parser.add_argument("--drain", type=float, default=60, help="longest wait for the outbox to empty at the end")
+    parser.add_argument("--publish-interval", type=float, default=30, help="mean seconds between a feed's new entries")
+    parser.add_argument("--initial-entries", type=int, default=20, help="entries each feed already has at start")
+    parser.add_argument("--cold-start", action="store_true", help="don't mark the initial entries as already posted")
+    parser.add_argument("--hosts", type=int, default=8, help="loopback addresses the feeds are spread over")
+    parser.add_argument("--feed-latency", type=float, default=50, help="ms before each feed or page response")
+    parser.add_argument("--slowloris", type=float, default=0.0, help="share of feed responses dribbled out slowly")
+    parser.add_argument("--slowloris-delay", type=float, default=1.0, help="seconds between dribbled writes")
+    parser.add_argument("--webhooks", type=int, default=5, help="distinct webhooks the feeds post to")
+    parser.add_argument("--webhook-latency", type=float, default=30, help="ms before each webhook response")
+    parser.add_argument("--webhook-429", type=float, default=0.02, help="share of posts answered 429 on top of the limit")
+    parser.add_argument("--webhook-5xx", type=float, default=0.01, help="share of posts answered 502")
+    parser.add_argument("--poll-interval", type=float, default=10, help="starting poll interval")
+    parser.add_argument("--min-interval", type=float, default=5)
+    parser.add_argument("--max-interval", type=float, default=60)
+    parser.add_argument("--mongod", action="store_true", help="run a throwaway mongod instead of mongomock")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="also write the report here")
+    parser.add_argument("--verbose", action="store_true", help="show the scripts' output instead of logging it")
+    args = parser.parse_args(argv)
+    args.sources = [source.strip() for source in args.sources.split(",") if source.strip()]
+    unknown = [source for source in args.sources if source not in SOURCES]
+    if unknown or not args.sources:
+        parser.error(f"--sources must be a subset of {','.join(SOURCES)}")
+    if not 1 <= args.subscriptions <= args.webhooks:
+        parser.error("--subscriptions must be between 1 and --webhooks")
+    if args.settle is None:
+        args.settle = args.max_interval + 10
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    # The outbox and preview cache live in the working directory
+    os.chdir(workdir)
+    mongod = None
+    try:
+        if args.mongod:
+            if not shutil.which("mongod"):
+                raise SystemExit("--mongod needs mongod on PATH")
+            mongod, os.environ["MONGO_URI"] = start_mongod(workdir)
+        from MongoDBHandler import DEFAULT_URI, MongoDBHandler
+        if mongod is None:
+            MongoDBHandler.use_client(DEFAULT_URI, mongomock_client())
+
+        stats = Stats()
+        site = FeedSite(args, stats)
+        site.serve()
+        discord = FakeDiscord(args, stats)
+        discord.serve()
+        seed_feeds(args, site, discord, MongoDBHandler, DEFAULT_URI)
+
+        from FeedDaemon import FeedDaemon
+        from Outbox import get_outbox
+        log_path = os.path.join(workdir, "scripts.log")
+        with open(log_path, "w") as log, contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+            daemon = FeedDaemon(args.sources, args.poll_interval, min_interval=args.min_interval,
+                                max_interval=args.max_interval)
+            site.wall_start = time.time()
+            started = site.start = time.monotonic()
+            stopper = threading.Timer(args.duration + args.settle, daemon.stop)
+            stopper.start()
+            daemon.run()
+            stopper.cancel()
+
+            # Messages still backing off after the daemon's final flush
+            outbox = get_outbox()
+            outbox.start()
+            deadline = time.monotonic() + args.drain
+            while outbox.pending() and time.monotonic() < deadline:
+                time.sleep(0.5)
+            outbox.close()
+            elapsed = time.monotonic() - started
+
+        print(f"scripts' output: {log_path}")
+        result = report(args, site, stats, started, elapsed)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as file:
+                json.dump(result, file, indent=2)
+    finally:
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
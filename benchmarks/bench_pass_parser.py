@@ -0,0 +1,71 @@
+"""Throughput of the single-scan pass summary parser against the old six-regex version.
+
+Runs offline over the summaries in benchmarks/fixtures. They are synthetic: generated in WSDoT's
+markup with randomised passes, times and conditions, some with fields left out, not captured from
+the live feed:
+
+    python benchmarks/bench_pass_parser.py
+"""
+import json
+import os
+import re
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PassReport import parse_pass_summary  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "wsdot_pass_summaries.json")
+
+
+# The previous PassParser.parse_html_passes, kept verbatim as the baseline
+def legacy_parse_html_passes(data_string):
+    data = {
+        "Name": re.search(r'<strong>(.*?)</strong>', data_string).group(1),
+        "Datetime": datetime.strptime(re.search(r'<strong>.*?</strong><br />(.*?)<br', data_string).group(1), '%m/%d/%Y %I:%M %p'),
+        "Temperature": re.search(r'<strong>Temperature:</strong>&nbsp;(.*?)&deg;F', data_string).group(1) + "°F",
+        "Directions": re.findall(r'<strong>(Eastbound|Westbound|Northbound|Southbound)</strong><br />(.*?)<br', data_string),
+        "Conditions": re.search(r'<strong>Conditions:</strong><br />(.*?)<br', data_string).group(1),
+        "Weather": re.search(r'<strong>Weather:</strong><br />(.*?)<br', data_string).group(1)
+    }
+    return data
+
+
+def main():
+    with open(FIXTURE, encoding="utf-8") as file:
+        summaries = json.load(file)
+
+    complete = []
+    crashes = 0
+    for summary in summaries:
+        try:
+            expected = legacy_parse_html_passes(summary)
+        except AttributeError:
+            crashes += 1
+            continue
+        complete.append(summary)
+        report = parse_pass_summary(summary)
+        actual = {"Name": report.name, "Datetime": report.datetime, "Temperature": report.temperature,
+                  "Directions": report.directions, "Conditions": report.conditions, "Weather": report.weather}
+        if actual != expected:
+            raise SystemExit(f"Mismatch on {summary!r}:\n{actual}\n{expected}")
+
+    def run_legacy():
+        for summary in complete:
+            legacy_parse_html_passes(summary)
+
+    def run_new():
+        for summary in complete:
+            parse_pass_summary(summary)
+
+    legacy_time = min(timeit.repeat(run_legacy, number=20, repeat=5)) / 20
+    new_time = min(timeit.repeat(run_new, number=20, repeat=5)) / 20
+    print(f"summaries: {len(summaries)} ({crashes} crash the old parser, skipped in timing)")
+    print(f"legacy: {len(complete) / legacy_time:>10.0f} summaries/s")
+    print(f"new:    {len(complete) / new_time:>10.0f} summaries/s ({legacy_time / new_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Compare the streaming preview extractor with the old BeautifulSoup fetch_preview.
+
+Runs offline over the saved pages in benchmarks/pages:
+
+    python benchmarks/bench_preview.py
+"""
+import os
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PreviewExtractor import (CHUNK_SIZE, RULE_CAMERA_DIV, RULE_IMG_AFTER_TITLE,  # noqa: E402
+                              RULE_PICTURE_IMG_WITHOUT_ALT, parse_preview)
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+
+# The pre-streaming implementations, kept verbatim as the baseline
+def legacy_npr(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    title_tag = soup.find('picture')
+    first_image_url = None
+    if title_tag:
+        for img_tag in title_tag.find_all_next('img'):
+            if not img_tag.get('alt'):
+                first_image_url = img_tag.get('src')
+                if first_image_url:
+                    break
+    return first_image_url or None
+
+
+def legacy_title(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    title_tag = soup.find('title')
+    first_image_url = None
+    if title_tag:
+        first_image_tag = title_tag.find_next('img')
+        if first_image_tag and first_image_tag.get('src'):
+            first_image_url = first_image_tag['src']
+    return first_image_url or None
+
+
+def legacy_camera(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    camera_image_div = soup.find('div', class_='flat-camera-image')
+    img_tag = camera_image_div.find('img') if camera_image_div else None
+    return img_tag['src'] if img_tag else None
+
+
+CASES = [
+    ("npr_article.html", RULE_PICTURE_IMG_WITHOUT_ALT, legacy_npr, True),
+    ("ars_article.html", RULE_IMG_AFTER_TITLE, legacy_title, True),
+    ("tumblr_post.html", RULE_IMG_AFTER_TITLE, legacy_title, True),
+    ("wsdot_camera.html", RULE_CAMERA_DIV, legacy_camera, False),
+]
+
+
+def chunked(html, consumed):
+    for start in range(0, len(html), CHUNK_SIZE):
+        consumed[0] += 1
+        yield html[start:start + CHUNK_SIZE]
+
+
+def streaming(html, rule, prefer_meta):
+    consumed = [0]
+    result = parse_preview(chunked(html, consumed), rule, prefer_meta)
+    return result, min(consumed[0] * CHUNK_SIZE, len(html))
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main():
+    print(f"{'page':<20} {'size':>8} {'read':>8} {'legacy ms':>10} {'stream ms':>10} {'rule ms':>10} {'speedup':>8}")
+    for page, rule, legacy, prefer_meta in CASES:
+        with open(os.path.join(PAGES_DIR, page), encoding="utf-8") as file:
+            html = file.read()
+
+        # With meta preference off the streaming parser must agree with the old rule exactly
+        rule_only, _ = streaming(html, rule, False)
+        expected = legacy(html)
+        if rule_only != expected:
+            raise SystemExit(f"{page}: streaming rule gave {rule_only!r}, legacy gave {expected!r}")
+        _, read = streaming(html, rule, prefer_meta)
+
+        legacy_time = best_of(lambda: legacy(html), 5)
+        stream_time = best_of(lambda: streaming(html, rule, prefer_meta), 20)
+        rule_time = best_of(lambda: streaming(html, rule, False), 20)
+        print(f"{page:<20} {len(html):>8} {read:>8} {legacy_time * 1000:>10.2f} {stream_time * 1000:>10.2f} "
+              f"{rule_time * 1000:>10.2f} {legacy_time / stream_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
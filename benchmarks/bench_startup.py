@@ -0,0 +1,77 @@
+"""Cold-start import cost of each feed script, measured with python -X importtime.
+
+Each source module is imported in a fresh interpreter, as a cron tick would. The baseline
+adds back the module-level feedparser and bs4 imports the scripts used to have. Runs offline:
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --budget-ms 400   # exit 1 if any source is slower
+
+Also fails if a source pulls in a dependency at startup that it should only load on use.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from discordfeeds import SOURCES  # noqa: E402
+
+LAZY = ("feedparser", "bs4", "lxml", "selectolax", "selenium")   # must not be imported until a parse or render needs them
+EAGER_BASELINE = ("feedparser", "bs4")
+HEAVY = ("requests", "pymongo", "feedparser", "bs4", "lxml", "selectolax", "sqlite3")
+INTERPRETER = ("site", "encodings", "_frozen_importlib_external", "zipimport")  # paid before any script code
+
+
+def import_times(statement, repeat):
+    # Best of `repeat` cold runs: ({module: cumulative us at its first import}, total us excluding interpreter start)
+    best = None
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                                   cwd=ROOT, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise SystemExit(f"{statement!r} failed:\n{completed.stderr}")
+        modules = {}
+        total = 0
+        for line in completed.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            top_level = not name.startswith("  ")
+            name = name.strip()
+            modules.setdefault(name, int(cumulative))
+            if top_level and name not in INTERPRETER:
+                total += int(cumulative)
+        if best is None or total < best[1]:
+            best = (modules, total)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'source':8} {'module':16} {'startup':>9} {'eager':>9}  heavy imports")
+    for source, module_name in SOURCES.items():
+        modules, total = import_times(f"import {module_name}", args.repeat)
+        _, eager_total = import_times(f"import {', '.join(EAGER_BASELINE)}, {module_name}", args.repeat)
+        heavy = ", ".join(f"{name} {modules[name] / 1000:.0f}ms" for name in HEAVY if name in modules)
+        print(f"{source:8} {module_name:16} {total / 1000:>7.1f}ms {eager_total / 1000:>7.1f}ms  {heavy}")
+
+        for name in LAZY:
+            if name in modules:
+                failures.append(f"{module_name} imports {name} at startup")
+        if args.budget_ms is not None and total / 1000 > args.budget_ms:
+            failures.append(f"{module_name} takes {total / 1000:.1f}ms to import (budget {args.budget_ms}ms)")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
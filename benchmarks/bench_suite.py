@@ -0,0 +1,288 @@
+"""Offline microbenchmarks for the per-entry hot paths, saved as JSON so runs can be compared.
+
+    python benchmarks/bench_suite.py                          # run everything
+    python benchmarks/bench_suite.py -k preview               # only names containing 'preview'
+    python benchmarks/bench_suite.py --save before.json
+    python benchmarks/bench_suite.py --compare before.json    # exit 1 on a regression
+
+Feeds come from benchmarks/fixtures and article pages from benchmarks/pages. Both are synthetic:
+the feeds are generated placeholder text in each site's format and the pages are offline replicas
+of each site's layout, so figures show relative cost, not live-site numbers. The fetch_preview
+benchmarks download the saved pages from a loopback HTTP server started here, and the preview
+cache lives in a temporary directory, so nothing leaves the machine. Each benchmark reports
+ops/sec (best of several repeats) and the peak and retained tracemalloc bytes of one op.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import feedparser  # noqa: E402
+import ArsTechnicaFeed  # noqa: E402
+import NPRFeed  # noqa: E402
+import TheVergeFeed  # noqa: E402
+import TumblrFeed  # noqa: E402
+import WSDoTFeed  # noqa: E402
+import WSDoTPasses  # noqa: E402
+from FeedStream import read_feed  # noqa: E402
+from PassIndex import PassIndex  # noqa: E402
+from SeenIndex import SeenIndex  # noqa: E402
+
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+PAGES = os.path.join(ROOT, "benchmarks", "pages")
+PASS_LIST = os.path.join(ROOT, "WSDotPasses.json")
+CHUNK_SIZE = 16 * 1024
+NEW_ENTRIES = 2        # entries left unseen in each fetch_new_entries poll, the usual case
+MIN_TIME = 0.2         # seconds each timing repeat runs for at least
+REPEAT = 5
+THRESHOLD = 0.25       # fractional slowdown (or allocation growth) --compare treats as a regression;
+                       # timings on a shared box swing 10-20% between identical runs
+MIN_ALLOC_DELTA = 1024  # bytes of peak allocation growth ignored as noise
+
+# Source name -> (script module, feed fixture)
+SOURCES = {
+    "npr": (NPRFeed, "npr.xml"),
+    "ars": (ArsTechnicaFeed, "ars.xml"),
+    "verge": (TheVergeFeed, "verge.xml"),
+    "tumblr": (TumblrFeed, "tumblr.xml"),
+    "wsdot": (WSDoTFeed, "wsdot_alerts.xml"),
+    "passes": (WSDoTPasses.FeedParser, "wsdot_passes.xml"),
+}
+
+# Source name -> (fetch_preview, saved page)
+PREVIEWS = {
+    "npr": (NPRFeed.fetch_preview, "npr_article.html"),
+    "ars": (ArsTechnicaFeed.fetch_preview, "ars_article.html"),
+    "verge": (TheVergeFeed.fetch_preview, "verge_article.html"),
+    "tumblr": (TumblrFeed.fetch_preview, "tumblr_post.html"),
+    "wsdot": (WSDoTFeed.fetch_preview, "wsdot_camera.html"),
+}
+
+
+def read_fixture(name, mode="rb"):
+    with open(os.path.join(FIXTURES, name), mode) as file:
+        return file.read()
+
+
+def chunked(data):
+    return (data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE))
+
+
+def cycling(function, inputs):
+    # One op is one call; successive ops walk through the inputs so no single one dominates
+    arguments = itertools.cycle(inputs)
+    return lambda: function(*next(arguments))
+
+
+def serve_pages():
+    pages = {}
+    for name in os.listdir(PAGES):
+        with open(os.path.join(PAGES, name), "rb") as file:
+            pages[f"/{name}"] = file.read()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real sites and our pooled client
+
+        def do_GET(self):
+            body = pages.get(self.path.split("?", 1)[0])
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            pass  # the streaming extractor hangs up once it has its image
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def feed_benchmarks():
+    for source, (module, fixture) in SOURCES.items():
+        data = read_fixture(fixture)
+        parsed = feedparser.parse(data).entries
+        key = WSDoTPasses.FeedParser.entry_key if source == "passes" else None
+        seen = SeenIndex(key=key) if key else SeenIndex()
+        seen.mark_seen(parsed[NEW_ENTRIES:])
+        yield (f"fetch_new_entries/{source}/feedparser",
+               lambda module=module, data=data, seen=seen: module.fetch_new_entries("", seen, data))
+        yield (f"fetch_new_entries/{source}/stream",
+               lambda module=module, data=data, seen=seen:
+               module.fetch_new_entries("", seen, entries=read_feed(chunked(data), seen).entries))
+
+    # Every entry new, so the BeautifulSoup pass over each entry's content is what's measured
+    verge_entries = feedparser.parse(read_fixture("verge.xml")).entries
+    yield ("verge_extract/20_entries", lambda: TheVergeFeed.fetch_new_entries("", SeenIndex(), entries=verge_entries))
+
+
+def preview_benchmarks(base_url):
+    counter = itertools.count()
+    for source, (fetch_preview, page) in PREVIEWS.items():
+        url = f"{base_url}/{page}"
+        # A fresh query string each call misses the cache and downloads the page
+        yield (f"fetch_preview/{source}/miss",
+               lambda fetch_preview=fetch_preview, url=url: fetch_preview(f"{url}?n={next(counter)}"))
+        if source != "wsdot":
+            # The camera preview is never cached; the others hit the in-memory LRU after the first call
+            yield f"fetch_preview/{source}/hit", lambda fetch_preview=fetch_preview, url=url: fetch_preview(url)
+
+
+def parser_benchmarks():
+    alerts = [(entry.summary,) for entry in feedparser.parse(read_fixture("wsdot_alerts.xml")).entries]
+    yield "parse_html/wsdot_alert", cycling(WSDoTFeed.parse_html, alerts)
+
+    summaries = [(summary,) for summary in json.loads(read_fixture("wsdot_pass_summaries.json", "r"))]
+    yield "parse_html_passes", cycling(WSDoTPasses.PassParser.parse_html_passes, summaries)
+
+    with open(PASS_LIST, encoding="utf-8") as file:
+        passes = json.load(file)
+    titles = [entry.title for entry in feedparser.parse(read_fixture("wsdot_passes.xml")).entries]
+    titles += [wa_pass["Pass"] for wa_pass in passes] + ["Stevens Pass US 2", "no such pass"]
+    yield "find_partial_match", cycling(WSDoTPasses.PassParser.find_partial_match, [(passes, title) for title in titles])
+    index = PassIndex(passes)
+    yield "find_partial_match/prebuilt_index", cycling(index.match, [(title,) for title in titles])
+
+
+def payload_benchmarks():
+    icon, color = "https://example.com/icon.png", 0x336699
+    for source in ("npr", "ars", "tumblr"):
+        module, fixture = SOURCES[source]
+        entries = feedparser.parse(read_fixture(fixture)).entries
+        yield (f"build_message/{source}",
+               cycling(module.build_message, [(source, icon, color, "news, tech", "https://example.com/a.jpg", entry)
+                                              for entry in entries]))
+
+    verge_entries = TheVergeFeed.fetch_new_entries("", SeenIndex(), entries=feedparser.parse(read_fixture("verge.xml")).entries)
+    yield ("build_message/verge",
+           cycling(TheVergeFeed.build_message, [("verge", icon, color, "", entry.image_url, entry, entry.summary_text)
+                                                for entry in verge_entries]))
+
+    alerts = feedparser.parse(read_fixture("wsdot_alerts.xml")).entries
+    yield "build_road_message", cycling(WSDoTFeed.build_road_message, [("wsdot", icon, color, "", entry) for entry in alerts])
+
+    with open(PASS_LIST, encoding="utf-8") as file:
+        index = PassIndex(json.load(file))
+    reports = []
+    for entry in feedparser.parse(read_fixture("wsdot_passes.xml")).entries:
+        wa_pass = index.match(entry.title)
+        if wa_pass is not None:
+            reports.append(("passes", icon, color, "", entry, wa_pass, WSDoTPasses.PassParser.parse_html_passes(entry.summary)))
+    yield "build_pass_message", cycling(WSDoTFeed.build_pass_message, reports)
+    yield "build_message_passes", cycling(WSDoTPasses.DiscordNotifier.build_message_passes, reports)
+
+
+def measure(function):
+    function()  # warm caches, lazy imports and connections
+    number = 1
+    while timeit.timeit(function, number=number) < MIN_TIME:
+        number *= 2
+    best = min(timeit.repeat(function, number=number, repeat=REPEAT)) / number
+
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    function()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ops_per_sec": 1 / best, "us_per_op": best * 1e6, "peak_bytes": peak - start,
+            "retained_bytes": max(0, current - start), "number": number}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    # Returns the names that got slower, or allocate more, by more than threshold
+    regressions = []
+    print(f"\n{'benchmark':44} {'ops/s before':>13} {'ops/s now':>13} {'change':>8} {'peak KB':>16}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = result["ops_per_sec"] / before["ops_per_sec"] - 1
+        alloc_growth = result["peak_bytes"] - before["peak_bytes"]
+        slower = change < -threshold
+        heavier = alloc_growth > MIN_ALLOC_DELTA and alloc_growth > threshold * before["peak_bytes"]
+        flag = "  SLOWER" if slower else ""
+        flag += "  MORE MEMORY" if heavier else ""
+        print(f"{name:44} {before['ops_per_sec']:>13,.0f} {result['ops_per_sec']:>13,.0f} {change:>+7.1%} "
+              f"{before['peak_bytes'] / 1024:>7.1f} -> {result['peak_bytes'] / 1024:<6.1f}{flag}")
+        if slower or heavier:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("-k", dest="pattern", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--save", metavar="PATH", help="write the results to PATH as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="compare against results saved with --save")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help=f"regression threshold (default {THRESHOLD})")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)["benchmarks"]
+
+    server = serve_pages()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        # The preview cache (and anything else keeping state in the working directory) stays out of the tree
+        os.chdir(workdir)
+        benchmarks = itertools.chain(feed_benchmarks(), preview_benchmarks(base_url), parser_benchmarks(), payload_benchmarks())
+        print(f"{'benchmark':44} {'ops/s':>13} {'us/op':>10} {'peak KB':>9} {'kept KB':>9}")
+        for name, function in benchmarks:
+            if args.pattern not in name:
+                continue
+            result = results[name] = measure(function)
+            print(f"{name:44} {result['ops_per_sec']:>13,.0f} {result['us_per_op']:>10.1f} "
+                  f"{result['peak_bytes'] / 1024:>9.1f} {result['retained_bytes'] / 1024:>9.1f}")
+        os.chdir(ROOT)
+    server.shutdown()
+
+    if args.save:
+        report = {"created": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": git_commit(),
+                  "python": platform.python_version(), "platform": platform.platform(), "benchmarks": results}
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+        print(f"\nSaved {len(results)} results to {args.save}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Command line entry point for the feed scripts.
+
+    python -m discordfeeds run npr verge      # one poll cycle of each source, then exit
+    python -m discordfeeds daemon             # keep polling every source (see FeedDaemon)
+    python -m discordfeeds daemon --metrics-port 9464
+    python -m discordfeeds daemon --metrics-port 9464 --metrics-host 0.0.0.0   # reachable off the host
+    python -m discordfeeds run npr --metrics-file /var/lib/node_exporter/discordfeeds.prom
+    python -m discordfeeds list
+
+Only the modules for the requested sources are imported, and those import their heavy
+dependencies (feedparser, bs4) on first use, so a cycle where nothing changed starts fast.
+"""
+import argparse
+import importlib
+import sys
+
+# Source name -> script module, run through FeedCycle (which lists the hooks a module provides)
+SOURCES = {
+    "npr": "NPRFeed",
+    "verge": "TheVergeFeed",
+    "ars": "ArsTechnicaFeed",
+    "tumblr": "TumblrFeed",
+    "wsdot": "WSDoTFeed",
+    "passes": "WSDoTPasses",
+}
+
+
+def run(sources, metrics_file=None):
+    import FeedCycle
+    for source in sources:
+        module = importlib.import_module(SOURCES[source])
+        try:
+            FeedCycle.run_cycle(module, module.load_feed_info())
+        except Exception as e:
+            print(f"Failed to run {source}: {e}")
+    if sources:
+        from Outbox import get_outbox
+        get_outbox().close()
+    if metrics_file:
+        from Metrics import REGISTRY
+        REGISTRY.write_textfile(metrics_file)
+
+
+def daemon(sources, interval=None, metrics_port=None, metrics_host=None):
+    from FeedDaemon import DEFAULT_INTERVAL, FeedDaemon
+    from Metrics import DEFAULT_HOST
+    FeedDaemon(sources or None, interval or DEFAULT_INTERVAL, metrics_port=metrics_port,
+               metrics_host=metrics_host or DEFAULT_HOST).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="discordfeeds", description="Post RSS feeds to Discord webhooks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run one poll cycle of the given sources")
+    run_parser.add_argument("sources", nargs="+", choices=sorted(SOURCES))
+    run_parser.add_argument("--metrics-file", help="write Prometheus metrics here after the run (textfile collector)")
+
+    daemon_parser = commands.add_parser("daemon", help="keep polling feeds until SIGTERM")
+    daemon_parser.add_argument("sources", nargs="*", help=f"default: all of {', '.join(SOURCES)}")
+    daemon_parser.add_argument("--interval", type=float, default=None, help="starting poll interval in seconds")
+    daemon_parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this port")
+    daemon_parser.add_argument("--metrics-host", default=None, help="address to serve metrics on (default: 127.0.0.1)")
+
+    commands.add_parser("list", help="list the available sources")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args.sources, args.metrics_file)
+    elif args.command == "daemon":
+        unknown = [source for source in args.sources if source not in SOURCES]
+        if unknown:
+            daemon_parser.error(f"unknown source: {', '.join(unknown)}")
+        daemon(args.sources, args.interval, args.metrics_port, args.metrics_host)
+    else:
+        for source, module in SOURCES.items():
+            print(f"{source:8} {module}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())